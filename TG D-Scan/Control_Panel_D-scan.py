@@ -21,12 +21,21 @@ import matplotlib.animation as animation
 import seabreeze # To read OceanOptics spectrometers
 seabreeze.use('pyseabreeze')
 import seabreeze.spectrometers as sb
-from D_scan_func import D_scan # To run the dispersion scan
+from D_scan_func import D_scan, resume_D_scan # To run (or continue) the dispersion scan
+from live_view import LiveSpectrogram # To show the spectrogram while the scan is running
+from stream_publisher import StreamPublisher, SPECTRUM, POSITION # To stream the readings to other processes
+from manual_scan import ManualScan # To store the manual dispersion scan
+from device_session import SessionRecorder # To record the device traffic of the session
 import matplotlib.pyplot as plt
 
 #*******Initialization*******
 axis = 1 #controller number
-stage = mmc100.mmc100(port='COM3') #creates an MMC100 object and connects to the motor on COM3
+stream_port = None #set to a port number (e.g. 5555) to stream spectra, positions and scan columns to local subscribers
+record_session = None #set to a file name (e.g. 'session.rec') to record the motor and spectrometer traffic for offline replay
+stage = mmc100.mmc100(port='COM3', name='D-scan wedge') #creates an MMC100 object and connects to the motor on COM3
+recorder = SessionRecorder(record_session) if record_session else None #see device_session.py for the replay
+if recorder is not None:
+    recorder.stage(stage) #logs every command and reply from here on
 stage.set_vel(axis, 200) #set motor velocity mm/s, Minimum = 0.001 mm/s
 stage.set_acc(axis, 200) #set acceleration mm/s^2
 stage.set_dec(axis, 200) #set deceleration mm/s^2
@@ -38,39 +47,59 @@ time.sleep(1) #this is placed to prevent errors with the spectrometer
 spec = sb.Spectrometer(devices[0])  #makes a specrtometer instance
 time.sleep(0.5) #this is placed to prevent errors with the spectrometer
 spec.integration_time_micros(inttime)
-
-fig = Figure(figsize = (9,5),tight_layout = True)
-ax1 = fig.add_subplot(121) #for the position-time plot
-ax2 = fig.add_subplot(122) #for the spectrum plot
+if recorder is not None:
+    spec = recorder.spectrometer(spec) #logs every reading
+publisher = StreamPublisher(stream_port) if stream_port else None #see stream_subscriber.py for a client
+
+fig = Figure(figsize = (9,8),tight_layout = True)
+ax1 = fig.add_subplot(221) #for the position-time plot
+ax2 = fig.add_subplot(222) #for the spectrum plot
+ax3 = fig.add_subplot(223) #for the live spectrogram during a scan
+ax4 = fig.add_subplot(224) #for the live delay marginal during a scan
+live = LiveSpectrogram(ax3, ax4) #updated column by column by the scan function
 times = [] #for storing the time stamps of the position readings
 positions = []
 bg = spec.intensities() #background spectrum array
 w = spec.wavelengths() #wavelength array
-manual_data = [] #initilizing array for manual dispersion scan
+manual_data = ManualScan(w, 'manual_Dscan.txt') #manual dispersion scan, every spectrum is appended to the file when taken
 
 #**********Start of GUI window************
 root = tk.Tk() #creates a tkinter GUI window
 root.title('D-Scan Control Panel')
-root.geometry('1400x900') # (width pixels X height pixels)
+root.geometry('1400x1200') # (width pixels X height pixels)
    
 def animate(i): #plots two graphs
     t = time.time() - start_time
-    times.append(t)     #add current time stamp
-    positions.append(stage.get_pos(axis))  #add current motor position
+    try:
+        pos = stage.get_pos(axis)
+    except mmc100.MMC100ReplyError: #garbled or missing reply, skip this point
+        pos = None
+    if pos is not None:
+        times.append(t)     #add current time stamp
+        positions.append(pos)  #add current motor position
     ax1.clear(), ax2.clear()
     ax1.plot(times[-100:], positions[-100:]) #plot the last 100 points
     ax1.set_xlabel('Time [s]'), ax1.set_ylabel('Position [mm]')
     ax1.set_title("P-T graph")
     
     y = spec.intensities() #get current spectrometer reading
+    if publisher is not None:
+        publisher.publish(SPECTRUM, y)
     ax2.plot(w, y)
     ax2.set_xlabel('Wavelength [nm]'), ax2.set_ylabel('Intensity')
     ax2.set_title("Spectrum")
     ax2.set_xlim([200,1200]), ax2.set_ylim([-1000, 60000])
 
 def read_pos(): #reads realtime position 
-    pos_reading.set(str(stage.get_pos(axis))) #gets the current position from controller and writes it to a GUI window widget
-    root.after(50, read_pos) #calls itself every 50 ms
+    root.after(50, read_pos) #calls itself every 50 ms (scheduled first so a bad reply doesn't stop the updates)
+    try:
+        pos = stage.get_pos(axis) #gets the current position from controller
+    except mmc100.MMC100ReplyError:
+        pos_reading.set('no reply')
+        return
+    pos_reading.set(str(pos)) #writes it to a GUI window widget
+    if publisher is not None:
+        publisher.publish(POSITION, np.array([pos]), value=pos)
 
 def move_to(pos):
     stage.mva(axis, pos, wait_stop=False) 
@@ -106,18 +135,12 @@ def set_decel():
 #The following functions are for manual D-scans
 def add_spec():
   spectrum = spec.intensities()
-  spectrum = np.insert(spectrum, 0, float(glass_thickness.get()))
   print spectrum
-  manual_data.append(spectrum)
+  manual_data.add(float(glass_thickness.get()), spectrum) #also appends it to manual_Dscan.txt
 
 def finished():
   print 'done!'
-  thicknesses = np.array(manual_data)[:, 0]
-  intensities = np.array(manual_data)[:, 1:]
-  w2 = np.insert(w, 0, 0) #adding a zero at beginning for size adjustment
-  manual_data.insert(0, w2) #wavelengths added as first row
-  with open('manual_Dscan.txt', 'w') as f:
-    np.savetxt(f, manual_data, fmt = '%.5f', delimiter = ',')
+  thicknesses, intensities = manual_data.sorted() #sorted by thickness, latest spectrum of a repeated thickness
     
   w3= w[543:654] #looking at smaller range of wavelengths around 400nm
   #plotting the 2D spectrogram
@@ -130,7 +153,7 @@ def finished():
   plt.show()
 
 def reset(data):
-  data *= 0 #clears the data array
+  data.reset() #clears the manual scan, manual_Dscan.txt is started over with the next spectrum
 
 #Widgets (labels and textboxes for user input)   
 pos1_label = tk.Label(root, text = 'Position 1 (mm)') 
@@ -146,7 +169,11 @@ inc_default = tk.StringVar(root, value=str(0.01))
 inc = tk.Entry(root, textvariable = inc_default)
 
 pos_reading_label = tk.Label(root, text = 'Position (mm)')
-pos_reading = tk.StringVar(root, value=str(stage.get_pos(axis)))
+pos_reading = tk.StringVar(root, value='no reply')
+try:
+    pos_reading.set(str(stage.get_pos(axis)))
+except mmc100.MMC100ReplyError: #garbled or missing reply, read_pos tries again every 50 ms
+    pass
 curr_pos = tk.Label(root, textvariable= pos_reading)
 
 vel_label = tk.Label(root, text = 'Velocity [mm/s]') #############
@@ -196,7 +223,11 @@ velBut   = tk.Button(root, text = 'Set', command = set_vel)
 accelBut = tk.Button(root, text = 'Set', command = set_accel)
 decelBut = tk.Button(root, text = 'Set', command = set_decel)
 StartBut = tk.Button(root, text= 'Start Aquisition', bg='#1CAAEF', command = lambda: D_scan(stage, spec,
-    float(inttime.get()), float(start_pos.get()), float(end_pos.get()), float(step_size.get()), float(deg.get())))
+    float(inttime.get()), float(start_pos.get()), float(end_pos.get()), float(step_size.get()), float(deg.get()), live=live,
+    publisher=publisher))
+
+ResumeBut = tk.Button(root, text= 'Resume Aquisition', bg='#1CAAEF', command = lambda: resume_D_scan(stage, spec, live=live,
+    publisher=publisher))
 
 takeSpecBut = tk.Button(root, text= 'Take Spectrum', bg='#1CAAEF', command = add_spec)
 doneBut = tk.Button(root, text= 'Done', bg='#1CAAEF', command = finished)
@@ -241,6 +272,7 @@ step_size.grid(row = 6, column = 5)
 deg_label.grid(row = 6, column = 6)
 deg.grid(row = 6, column = 7)
 StartBut.grid(row = 6, column = 8, padx= 15)
+ResumeBut.grid(row = 6, column = 9)
 
 manualScan_label.grid(row=7, column = 3,  padx= 15, pady = 15)
 glass_label.grid(row=8, column = 0)
@@ -265,4 +297,9 @@ root.mainloop()
 
 stage.ser.close() #terminates communication with the motor
 spec.close()  #terminates communication with the spectrometer
+manual_data.close()
+if publisher is not None:
+    publisher.close() #disconnects the subscribers
+if recorder is not None:
+    recorder.close()
 
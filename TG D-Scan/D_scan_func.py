@@ -19,6 +19,15 @@ Parameters:
     step_size: step size taken by the motor during delay sweep. MMC100 highest resolution = 1 nm
     deg: The angle of the wedges used for introducing dispersion. This is used to calculate the relative thickness added to the beam path.
     axis: the motor controller number. Since only one motor (one dimension) is used in my FROG experiments the axis # is always 1.
+    checkpoint: folder the scan progress is saved to every checkpoint_every positions, only the new spectra are written
+                each time (see scan_checkpoint.py). A fresh scan clears it first.
+                An interrupted scan can be continued with resume_D_scan(stage, spec).
+    resume: when TRUE the scan continues from the checkpoint folder instead of starting over.
+    publisher: optional stream_publisher.StreamPublisher, every spectrum is streamed as a COLUMN frame
+               (seq = column index, value = commanded position).
+    live: optional live_view.LiveSpectrogram that shows the spectrogram column by column while the scan is running.
+
+The commanded position, the measured encoder position and the time stamp of every spectrum are saved in positions.txt.
     
 The data.txt file structure is as follows, where THK = thickness value, WAV = wavelegnth value, INT = intensity value
 
@@ -32,15 +41,22 @@ WAV INT INT INT INT ...\n
 .    .   .   .   .  ...\n
 """
 
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 import seabreeze # To read OceanOptics spectrometers
 seabreeze.use('pyseabreeze')
+from stream_publisher import COLUMN, WAVELENGTHS
+from scan_checkpoint import CHECKPOINT_FILE, save_checkpoint, load_checkpoint, clear_checkpoint
+from motion_tuner import apply_profile, restore_motion
+from device_session import mark_scan
 
 
-def D_scan(stage, spec, inttime, start_pos, end_pos, step_size, deg, axis=1):
+def D_scan(stage, spec, inttime, start_pos, end_pos, step_size, deg, axis=1,
+           checkpoint=CHECKPOINT_FILE, checkpoint_every=50, resume=False, live=None, publisher=None):
   print 'starting Dispersion-Scan'
   #*******Initialization*******
+  mark_scan(stage, spec) #start of the scan in a recorded session (see device_session.py)
   n = int(abs(start_pos-end_pos)/step_size + 1) #number of positions
   if end_pos<start_pos:
     step_size = -step_size
@@ -50,29 +66,63 @@ def D_scan(stage, spec, inttime, start_pos, end_pos, step_size, deg, axis=1):
   #The thicknesses are relative to the starting position, and the starting position of the motor for the wedges is assumed to be set to zero beforehand 
   
   spec.integration_time_micros(inttime) #sets spectrometer's integration time
-  w = spec.wavelengths() #array of spectrometer wavelegnths
-  bg = spec.intensities() #array of background spectrum 
-  data = [[0]*len(p) for _ in range(len(w))] #initilizaes a matrix for spectrum data [len(w) x len(p)]
-                                             #every row corresponds to a wavelength and every column to a position
+  motion = apply_profile(stage, axis, step_size) #tuned velocity/acceleration for this step size, if there is one (see motion_tuner.py)
+  if resume: #continue an interrupted scan from its checkpoint
+    ck = load_checkpoint(checkpoint)
+    w = ck['w'] #wavelengths of the interrupted scan
+    col = int(ck['col']) #next unfinished position
+    data = np.zeros((len(w), len(p)))
+    data[:, :col] = ck['data'] #spectra that were already acquired
+    enc = ck['enc'] #measured encoder positions of the interrupted scan
+    stamps = ck['stamps'] #time stamps of the interrupted scan
+    print 'resuming Dispersion-Scan at position ' + str(col)
+    if col < n:
+      pos_now = stage.mva(axis, p[col]) #motor moves back to the next unfinished position
+  else:
+    clear_checkpoint(checkpoint) #the columns of an older scan must not end up in the new checkpoint
+    w = spec.wavelengths() #array of spectrometer wavelegnths
+    bg = spec.intensities() #array of background spectrum 
+    data = np.zeros((len(w), len(p))) #initilizaes a matrix for spectrum data [len(w) x len(p)]
+                                      #every row corresponds to a wavelength and every column to a position
+    enc = np.zeros(n) #measured encoder position of every spectrum
+    stamps = np.zeros(n) #time stamp of every spectrum
+    col = 0 #column index 
+    pos_now = stage.mva(axis, start_pos) #motor moves to starting position, returns the (theoretical, encoder) position
+  if publisher is not None:
+    publisher.publish(WAVELENGTHS, w)
+  if live is not None:
+    live.start(w, p, data, col) #preallocates the live spectrogram (with the columns of a resumed scan)
 
   #*******Dipersion scan******* 
-  stage.mva(axis, start_pos) #motor moves to starting position
-  col = 0 #column index 
   while (col<n): 
+    stamps[col] = time.time()
     I = spec.intensities() #- bg #captures spectrum 
-    for i in range(len(w)): #adds intensities to data matrix
-      data[i][col] = I[i]
+    data[:, col] = I #adds intensities to data matrix
+    enc[col] = pos_now[1] #encoder position read when the previous move finished
+    if live is not None:
+      live.add_column(col, I)
+    if publisher is not None:
+      publisher.publish(COLUMN, I, seq=col, value=p[col])
     col += 1
     print col #to keep track of how many positions are left in the sweep
+    if col % checkpoint_every == 0: #periodically saves the progress in case the scan gets interrupted
+      save_checkpoint(checkpoint, col, data, p, w, enc=enc, stamps=stamps, inttime=inttime, start_pos=start_pos,
+                      end_pos=end_pos, step_size=abs(step_size), deg=deg, axis=axis, stage_pos=pos_now[1])
     if col != n:
-      stage.mvr(axis, step_size) #moves to the next position
+      pos_now = stage.mvr(axis, step_size) #moves to the next position
     #time.sleep(0.1)
+  clear_checkpoint(checkpoint) #the scan is complete, the checkpoint is no longer needed
+  restore_motion(stage, axis, motion) #the velocity/acceleration set in the panel again
+  if live is not None:
+    live.finish()
   
   stage.mva(axis, start_pos) #returns motor to the start position
   
   print 'Scan is finished\n Data will now be saved\n\n'
   
   #*******Finalization*******
+  with open('positions.txt', 'w') as f: #commanded position, measured encoder position and time stamp of every spectrum
+    np.savetxt(f, np.c_[p, enc, stamps], fmt = '%.6f', delimiter = ',', header = 'commanded [mm], encoder [mm], time [s]')
   intensities = np.array(data[:]) #copy of the original data matrix which only contains the intensities
   thickness2 = thickness[:] #copy of the original thickness array
 
@@ -105,4 +155,9 @@ def D_scan(stage, spec, inttime, start_pos, end_pos, step_size, deg, axis=1):
   
 
 
-
+def resume_D_scan(stage, spec, checkpoint=CHECKPOINT_FILE, checkpoint_every=50, live=None, publisher=None):
+  '''Continues an interrupted dispersion scan from its checkpoint folder. The scan parameters are read from the checkpoint.'''
+  ck = load_checkpoint(checkpoint)
+  D_scan(stage, spec, float(ck['inttime']), float(ck['start_pos']), float(ck['end_pos']), float(ck['step_size']),
+         float(ck['deg']), axis=int(ck['axis']), checkpoint=checkpoint, checkpoint_every=checkpoint_every, resume=True,
+         live=live, publisher=publisher)
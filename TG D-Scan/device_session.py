@@ -0,0 +1,289 @@
+'''
+Description: Record-and-replay of the device traffic of a lab session. While recording, the serial port of an mmc100
+            object is wrapped, so every command written by _exec_cmd/_exec_batch and every reply line is logged, and
+            spectrometers are wrapped so every spectrum, wavelength axis and integration time setting is logged, all
+            with the time the call started and how long it blocked. A recorded session can be replayed without the
+            hardware: Session.stage() and Session.spectrometer() give objects that answer the scan functions with the
+            recorded replies and spectra, waiting the recorded device time (divided by speed), so a real scan can be
+            rerun offline to check that a change gives identical data and how it changes the wall-clock time.
+            The scan functions call mark_scan() when they start, so the scans of a recorded panel session can be
+            replayed one at a time, skipping the panel's own polling before them.
+To make use of it:\n
+    rec = device_session.SessionRecorder('session.rec')\n
+    rec.stage(stage)   (wraps stage.ser in place)\n
+    spec = rec.spectrometer(spec)\n
+    ... run the scan, then rec.close()\n
+    session = device_session.Session('session.rec')\n
+    delay_stage(session.stage(speed=10, scan=0), session.spectrometer(speed=10, scan=0), inttime, start_pos, end_pos, step_size)
+
+The session file is a sequence of records, each one a header struct '<BBddI' (kind, device id, start time [s] since the
+start of the session, duration [s], payload length) followed by the payload:
+    META: json description of a device ({'type': 'stage', 'axes': [...], 'name': ...} or {'type': 'spectrometer', ...})
+    WRITE / READLINE: the bytes written to / read from the serial port
+    SPECTRUM / WAVELENGTHS: a dtype character and the array bytes (spectra with integer counts are stored as uint16)
+    INTTIME: the integration time [us] as a double
+    SCAN: start of a scan (device id SCAN_DEV, no payload)
+'''
+import json
+import struct
+import threading
+import time
+from collections import deque
+import numpy as np
+import mmc100
+
+HEADER = struct.Struct('<BBddI')
+META, WRITE, READLINE, SPECTRUM, WAVELENGTHS, INTTIME, SCAN = range(7)
+SCAN_DEV = 255 #device id of the SCAN records, they apply to all the devices
+
+
+class ReplayMismatch(Exception):
+    '''The replayed code asked the devices for something other than what was recorded.'''
+    pass
+
+
+def _pack_array(a):
+    a = np.asarray(a)
+    if a.size and np.all(a == np.round(a)) and a.min() >= 0 and a.max() <= 65535: #spectrometer counts
+        return b'H' + a.astype('<u2').tobytes()
+    return b'd' + a.astype('<f8').tobytes()
+
+
+def _unpack_array(payload):
+    return np.frombuffer(payload[1:], dtype='<u2' if payload[:1] == b'H' else '<f8').astype(float)
+
+
+class SessionRecorder:
+    def __init__(self, fname):
+        '''Creates the session file fname. The recorded devices are added with stage() and spectrometer().'''
+        self.f = open(fname, 'wb')
+        self.lock = threading.Lock() #the spectrometers may be read from several threads (see multi_spec.py)
+        self.t0 = time.time()
+        self.ndev = 0
+
+    def write(self, kind, dev, t, dt, payload):
+        with self.lock:
+            self.f.write(HEADER.pack(kind, dev, t - self.t0, dt, len(payload)))
+            self.f.write(payload)
+
+    def _add_device(self, meta):
+        dev = self.ndev
+        self.ndev += 1
+        self.write(META, dev, time.time(), 0.0, json.dumps(meta).encode('utf-8'))
+        return dev
+
+    def mark_scan(self):
+        '''Writes a SCAN record, the replay of a scan starts after it (see Session.stage).'''
+        self.write(SCAN, SCAN_DEV, time.time(), 0.0, b'')
+
+    def stage(self, stage):
+        '''Starts recording the serial traffic of an mmc100 object (its port is wrapped in place). Returns the stage.'''
+        meta = {'type': 'stage', 'axes': stage.axes, 'name': stage.name}
+        stage.ser = RecordingSerial(stage.ser, self, self._add_device(meta))
+        return stage
+
+    def spectrometer(self, spec):
+        '''Returns a wrapper of spec that records its readings. Use it in place of spec.'''
+        meta = {'type': 'spectrometer', 'serial_number': str(getattr(spec, 'serial_number', ''))}
+        return RecordingSpectrometer(spec, self, self._add_device(meta))
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+def mark_scan(stage, *specs):
+    '''Marks the start of a scan in the session the stage or the spectrometers are recorded to, if any.
+        Called by the scan functions before their first device command.'''
+    recorders = [getattr(stage.ser, 'recorder', None)] + [getattr(spec, 'recorder', None) for spec in specs]
+    for recorder in set(r for r in recorders if isinstance(r, SessionRecorder)):
+        recorder.mark_scan()
+
+
+class RecordingSerial:
+    '''Serial port wrapper that logs every write and readline.'''
+    def __init__(self, ser, recorder, dev):
+        self.ser = ser
+        self.recorder = recorder
+        self.dev = dev
+
+    def write(self, data):
+        t = time.time()
+        n = self.ser.write(data)
+        self.recorder.write(WRITE, self.dev, t, time.time() - t, bytes(data))
+        return n
+
+    def readline(self):
+        t = time.time()
+        line = self.ser.readline()
+        self.recorder.write(READLINE, self.dev, t, time.time() - t, line)
+        return line
+
+    def __getattr__(self, name): #flush, reset_input_buffer, close, ... are passed through
+        return getattr(self.ser, name)
+
+
+class RecordingSpectrometer:
+    '''Spectrometer wrapper that logs every spectrum, wavelength axis and integration time setting.'''
+    def __init__(self, spec, recorder, dev):
+        self.spec = spec
+        self.recorder = recorder
+        self.dev = dev
+
+    def intensities(self):
+        t = time.time()
+        I = self.spec.intensities()
+        self.recorder.write(SPECTRUM, self.dev, t, time.time() - t, _pack_array(I))
+        return I
+
+    def wavelengths(self):
+        t = time.time()
+        w = self.spec.wavelengths()
+        self.recorder.write(WAVELENGTHS, self.dev, t, time.time() - t, _pack_array(w))
+        return w
+
+    def integration_time_micros(self, inttime):
+        t = time.time()
+        self.spec.integration_time_micros(inttime)
+        self.recorder.write(INTTIME, self.dev, t, time.time() - t, struct.pack('<d', inttime))
+
+    def __getattr__(self, name): #serial_number, close, ... are passed through
+        return getattr(self.spec, name)
+
+
+class Session:
+    def __init__(self, fname):
+        '''Loads a session file. Records are grouped per device, in the order they were recorded.'''
+        self.meta = []
+        self.records = {} #{device id: list of (kind, start time, duration, payload)}
+        self.scans = [] #{device id: index of its first record in the scan} for every recorded scan
+        with open(fname, 'rb') as f:
+            while True:
+                head = f.read(HEADER.size)
+                if len(head) < HEADER.size: #end of file (or a record cut off by a crash)
+                    break
+                kind, dev, t, dt, n = HEADER.unpack(head)
+                payload = f.read(n)
+                if len(payload) < n:
+                    break
+                if kind == META:
+                    self.meta.append(json.loads(payload.decode('utf-8')))
+                    self.records[dev] = []
+                elif kind == SCAN:
+                    self.scans.append(dict((d, len(r)) for d, r in self.records.items()))
+                else:
+                    self.records[dev].append((kind, t, dt, payload))
+
+    def _device(self, kind, i):
+        devs = [dev for dev, meta in enumerate(self.meta) if meta['type'] == kind]
+        if i >= len(devs):
+            raise ValueError('the session has ' + str(len(devs)) + ' recorded ' + kind + '(s)')
+        return devs[i]
+
+    def _start(self, dev, scan):
+        '''Index of the first record of dev to replay: 0, or the start of the scan-th recorded scan.'''
+        if scan is None:
+            return 0
+        if scan >= len(self.scans):
+            raise ValueError('the session has ' + str(len(self.scans)) + ' recorded scan(s)')
+        return self.scans[scan].get(dev, 0) #a device added after the scan started has all its records in it
+
+    def stage(self, i=0, speed=1.0, strict=True, scan=None):
+        '''Returns an mmc100 object that replays the i-th recorded stage.\n
+            speed: replay speed factor (1: recorded timing, 10: ten times faster, None: no waiting)
+            strict: raise ReplayMismatch when a written command differs from the recorded one
+            scan: replay from the start of the scan-th recorded scan (0: the first one), None: from the beginning'''
+        dev = self._device('stage', i)
+        ser = ReplaySerial(deque(self.records[dev][self._start(dev, scan):]), speed, strict)
+        return ReplayStage(ser, self.meta[dev]['axes'], self.meta[dev].get('name', 'replay'))
+
+    def spectrometer(self, i=0, speed=1.0, scan=None):
+        '''Returns an object that replays the i-th recorded spectrometer (speed and scan as for stage).'''
+        dev = self._device('spectrometer', i)
+        start = self._start(dev, scan)
+        spec = ReplaySpectrometer(deque(self.records[dev][start:]), self.meta[dev], speed)
+        for kind, t, dt, payload in reversed(self.records[dev][:start]): #wavelengths read before the scan started
+            if kind == WAVELENGTHS:
+                spec.w = _unpack_array(payload)
+                break
+        return spec
+
+
+def _next(records, kinds, speed):
+    '''Pops the next record of one of kinds (the other kinds in between are skipped) and waits its recorded duration.'''
+    while records:
+        kind, t, dt, payload = records.popleft()
+        if kind in kinds:
+            if speed:
+                time.sleep(dt/speed)
+            return kind, payload
+    raise ReplayMismatch('the recorded session has ended')
+
+
+class ReplayStage(mmc100.mmc100):
+    '''mmc100 object driven by a ReplaySerial. No port is opened and no commands are sent on creation.'''
+    def __init__(self, ser, axes, name):
+        self.name = name #tuned motion profiles are looked up with the name of the recorded stage
+        self.lock = threading.Lock()
+        self.ser = ser
+        self.axes = axes
+
+
+class ReplaySerial:
+    '''Serial port stand-in that checks the writes and returns the recorded reply lines.'''
+    def __init__(self, records, speed, strict):
+        self.records = records
+        self.speed = speed
+        self.strict = strict
+        self.mismatches = 0 #number of writes that differed from the recording (strict=False)
+
+    def write(self, data):
+        kind, payload = _next(self.records, (WRITE,), self.speed)
+        if bytes(data) != payload:
+            self.mismatches += 1
+            if self.strict:
+                raise ReplayMismatch('expected ' + repr(payload) + ', got ' + repr(bytes(data)))
+        return len(data)
+
+    def readline(self):
+        if not self.records or self.records[0][0] != READLINE: #nothing was read here while recording: a timeout
+            return b''
+        return _next(self.records, (READLINE,), self.speed)[1]
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplaySpectrometer:
+    '''Spectrometer stand-in that returns the recorded spectra.'''
+    def __init__(self, records, meta, speed):
+        self.records = records
+        self.serial_number = meta.get('serial_number', '')
+        self.speed = speed
+        self.w = None
+
+    def intensities(self):
+        return _unpack_array(_next(self.records, (SPECTRUM,), self.speed)[1])
+
+    def wavelengths(self):
+        if self.records and self.records[0][0] == WAVELENGTHS:
+            self.w = _unpack_array(_next(self.records, (WAVELENGTHS,), self.speed)[1])
+        if self.w is None:
+            raise ReplayMismatch('no wavelengths were recorded')
+        return self.w
+
+    def integration_time_micros(self, inttime):
+        if self.records and self.records[0][0] == INTTIME:
+            _next(self.records, (INTTIME,), self.speed)
+
+    def close(self):
+        pass
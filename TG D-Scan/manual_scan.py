@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Session object for the manual (discrete) dispersion scan of Control_Panel_D-scan.py. The spectra are kept
+            in a growable array buffer (the capacity doubles when it is full, so adding a spectrum is amortized O(1))
+            and every spectrum is appended to the text file as soon as it is taken, so nothing is lost if the panel
+            is closed and finishing the scan never re-writes the whole file.
+To make use of it:\n
+    session = manual_scan.ManualScan(spec.wavelengths())\n
+    session.add(thickness, spec.intensities())\n
+    thicknesses, intensities = session.sorted()
+
+The manual_Dscan.txt file structure is the same as before, where THK = thickness value, WAV = wavelegnth value,
+INT = intensity value. The rows are in the order the spectra were taken.
+
+0.0 WAV WAV WAV WAV ...\n
+THK INT INT INT INT ...\n
+THK INT INT INT INT ...\n
+.    .   .   .   .  ...\n
+"""
+import numpy as np
+
+
+class ManualScan:
+    def __init__(self, w, fname='manual_Dscan.txt', capacity=16):
+        '''w: array of spectrometer wavelengths, fname: file the spectra are appended to, capacity: initial buffer size.'''
+        self.w = np.asarray(w)
+        self.fname = fname
+        self.buf = np.empty((capacity, len(self.w)+1)) #every row: thickness followed by the spectrum
+        self.n = 0 #number of spectra taken
+        self.f = None #the file is (re)created when the first spectrum is added
+
+    def add(self, thickness, spectrum):
+        '''Adds the spectrum taken at the given glass thickness [mm] and appends it to the file.'''
+        if self.n == len(self.buf): #buffer full, double its capacity
+            buf = np.empty((2*len(self.buf), self.buf.shape[1]))
+            buf[:self.n] = self.buf[:self.n]
+            self.buf = buf
+        self.buf[self.n, 0] = thickness
+        self.buf[self.n, 1:] = spectrum
+        if self.f is None:
+            self.f = open(self.fname, 'w')
+            np.savetxt(self.f, [np.insert(self.w, 0, 0)], fmt = '%.5f', delimiter = ',') #wavelengths as first row
+        np.savetxt(self.f, self.buf[self.n:self.n+1], fmt = '%.5f', delimiter = ',')
+        self.f.flush()
+        self.n += 1
+
+    @property
+    def thicknesses(self):
+        return self.buf[:self.n, 0]
+
+    @property
+    def intensities(self):
+        return self.buf[:self.n, 1:]
+
+    def sorted(self, average=False):
+        '''Returns (thicknesses, intensities) sorted by thickness with one spectrum per thickness.
+            A thickness that was measured more than once keeps its latest spectrum, or the mean of all of them with average=True.
+            The buffer and the file are not changed.'''
+        if average:
+            thk, inv = np.unique(self.thicknesses, return_inverse=True)
+            intensities = np.zeros((len(thk), len(self.w)))
+            np.add.at(intensities, inv, self.intensities)
+            intensities /= np.bincount(inv)[:, None]
+        else:
+            thk, idx = np.unique(self.thicknesses[::-1], return_index=True) #first in reversed order = latest spectrum
+            intensities = self.intensities[self.n-1-idx]
+        return thk, intensities
+
+    def reset(self):
+        '''Clears the session. The file is started over when the next spectrum is added.'''
+        self.n = 0
+        self.close()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
@@ -4,17 +4,73 @@ Last Edited: July 5, 2022
 Description: MMC100 class with methods for interacting with the MMC100 motor.\n
 To make use of these functions/methods, first import this script and create a motor instance:\n
     import mmc100\n
-    motorInstance = mmc100.mmc100(port)
+    motorInstance = mmc100.mmc100(port, name)
 '''
 import serial
 import io
 import time
 import threading
 import math
+import re
+from collections import namedtuple
+
+#Precompiled parsers for the controller replies. They work directly on the bytes returned by readline,
+#e.g. b'#8\n' for STA? and b'#-0.060000,-0.059998\n' for POS? (theoretical position, encoder position)
+_NUM = br'([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)'
+_STA_REPLY = re.compile(br'#\s*(\d+)')
+_POS_REPLY = re.compile(br'#\s*' + _NUM + br'\s*,\s*' + _NUM)
+_VALUE_REPLY = re.compile(br'#\s*' + _NUM)
+
+#Bits of the STA? status byte
+STA_NEG_LIMIT = 1 #negative limit switch
+STA_POS_LIMIT = 2 #positive limit switch
+STA_STOPPED = 8 #motor is not moving
+STA_ERROR = 128 #an error occurred, read it with read_err
+
+#Snapshot of one axis: positions [mm], decoded status flags and the raw status byte
+AxisStatus = namedtuple('AxisStatus', 'theoretical encoder moving error pos_limit neg_limit status')
+
+
+class MMC100Error(Exception):
+    '''Base class of the errors raised by the mmc100 class.'''
+
+class MMC100ReplyError(MMC100Error):
+    '''The controller did not answer, or the reply could not be parsed.'''
+
+
+def parse_sta(reply):
+    '''Parses a STA? reply. Returns the status byte as an int.'''
+    m = _STA_REPLY.search(reply)
+    if m is None:
+        raise MMC100ReplyError('invalid STA reply: ' + repr(reply))
+    return int(m.group(1))
+
+def parse_pos(reply):
+    '''Parses a POS? reply. Returns (theoretical position, encoder position) in [mm].'''
+    m = _POS_REPLY.search(reply)
+    if m is None:
+        raise MMC100ReplyError('invalid POS reply: ' + repr(reply))
+    return float(m.group(1)), float(m.group(2))
+
+def parse_value(reply):
+    '''Parses the reply of a single value query (e.g. VEL?, ACC?, DEC?). Returns it as a float.'''
+    m = _VALUE_REPLY.search(reply)
+    if m is None:
+        raise MMC100ReplyError('invalid reply: ' + repr(reply))
+    return float(m.group(1))
+
+def _axis_status(sta, pos):
+    status = parse_sta(sta)
+    theo, enc = parse_pos(pos)
+    return AxisStatus(theo, enc, not status & STA_STOPPED, bool(status & STA_ERROR),
+                      bool(status & STA_POS_LIMIT), bool(status & STA_NEG_LIMIT), status)
+
 
 class mmc100:
-    def __init__(self, port):
-        '''Initializes an mmc100 instance.\n port: The communication port name for the motor.'''
+    def __init__(self, port, name=None):
+        '''Initializes an mmc100 instance.\n port: The communication port name for the motor.
+            name: name of the stage, used to keep its tuned motion profiles apart (default: the port name)'''
+        self.name = name if name is not None else port
         self.lock = threading.Lock()
         self.ser = serial.Serial(port, timeout=0.5, baudrate=38400) #initializes communication port object
         self.ser.reset_input_buffer()
@@ -55,6 +111,19 @@ class mmc100:
         self.ser.flush()
         if query:
             return self.ser.readline()
+
+    def _exec_batch(self, cmds):
+        '''Sends several query commands in a single write and reads back one reply per command.\n
+            cmds: list of (axis, cmd) pairs, e.g. [(1, 'STA'), (1, 'POS')]
+            Costs one round trip instead of one per command.
+        '''
+        cmd_full = ''.join(str(axis)+cmd+'?\n\r' for axis, cmd in cmds)
+        with self.lock:
+            self.ser.reset_output_buffer()
+            self.ser.reset_input_buffer()
+            self.ser.write(bytearray(cmd_full, 'ascii'))
+            self.ser.flush()
+            return [self.ser.readline() for _ in cmds]
         
     def probe_axes(self):
         self.axes = []
@@ -63,16 +132,12 @@ class mmc100:
                 self.axes.append(ind)
    
     def get_pos(self, axis):
-        '''Get the motor's position in [mm]. Returns the theoretical position.'''
+        '''Get the motor's position in [mm]. Returns the theoretical position.\n Raises MMC100ReplyError if the reply is invalid.'''
         self.lock.acquire()
-        pos = str(self._exec_cmd(axis=axis, cmd='POS', query=True))
+        pos = self._exec_cmd(axis=axis, cmd='POS', query=True)
         self.lock.release()
-        #print(pos)
-        try:
-            #changed it so that the obtained position is the theoretical pos and not the encoder pos. The theoretical pos is returned first (index 0)
-            return float(pos.split('#')[1].split(',')[0].split('\\n')[0])
-        except:
-            return 0.0
+        #changed it so that the obtained position is the theoretical pos and not the encoder pos. The theoretical pos is returned first (index 0)
+        return parse_pos(pos)[0]
     
     def __update_pos(self):
         while True:
@@ -82,29 +147,62 @@ class mmc100:
             time.sleep(200.00)
       
     def ismoving(self, axis):
-        '''Check if motor is in motion. Returns TRUE if it is.'''
+        '''Check if motor is in motion. Returns TRUE if it is.\n Raises MMC100ReplyError if the reply is invalid.'''
         res = self._exec_cmd(axis=axis, cmd='STA',  query=True)
-        try:
-            if((int( str(res).split('#')[1].split('\\n')[0] )//8)%2 == 0):
-                return True
-            else:
-                return False
-        except Exception:
-            return True
+        return not parse_sta(res) & STA_STOPPED
+
+    def status(self, axes=None):
+        '''Reads position (theoretical and encoder), moving state and error flags of several axes in one batched exchange.\n
+            axes: list of controller numbers, all the discovered axes (self.axes) by default.
+            Returns a dict of {axis: AxisStatus}. Raises MMC100ReplyError if a reply is missing or invalid.'''
+        if axes is None:
+            axes = self.axes
+        cmds = []
+        for axis in axes:
+            cmds += [(axis, 'STA'), (axis, 'POS')]
+        replies = self._exec_batch(cmds)
+        return dict((axis, _axis_status(replies[2*k], replies[2*k+1])) for k, axis in enumerate(axes))
+
+    def poll_status(self, axis):
+        '''Reads the motion status and the position of an axis in one exchange (STA? and POS? sent together).\n
+            Returns (moving, theoretical position [mm], encoder position [mm]).'''
+        st = self.status([axis])[axis]
+        return st.moving, st.theoretical, st.encoder
+
+    def _wait_stopped(self, axes, retries=3):
+        '''Polls the axes until none of them is moving and returns their last status. A garbled reply is
+            polled again, up to retries times in a row, before the MMC100ReplyError is raised.'''
+        failed = 0
+        while True:
+            try:
+                st = self.status(axes)
+                failed = 0
+            except MMC100ReplyError:
+                failed += 1
+                if failed > retries:
+                    raise
+                continue
+            if not any(s.moving for s in st.values()):
+                return st
+            time.sleep(.05)
+
+    def wait_until_stopped(self, axis):
+        '''Polls the axis until it stops. Returns the (theoretical, encoder) position read by the last poll,
+            so the settled position comes for free with the completion check.'''
+        st = self._wait_stopped([axis])[axis]
+        return st.theoretical, st.encoder
     
     def mva(self, axis, pos, wait_stop = True):
-        '''Move the motor to an absolute position.'''
+        '''Move the motor to an absolute position. With wait_stop, returns the settled (theoretical, encoder) position.'''
         self._exec_cmd(axis=axis, cmd='MVA', num=pos, query=False)
         if(wait_stop):
-            while(self.ismoving(axis)):
-                time.sleep(.05)
+            return self.wait_until_stopped(axis)
 
     def mvr(self, axis, pos, wait_stop = True):
-        '''Move the motor to a relative position.'''
+        '''Move the motor to a relative position. With wait_stop, returns the settled (theoretical, encoder) position.'''
         self._exec_cmd(axis=axis, cmd='MVR', num=pos, query=False)
         if(wait_stop):
-            while(self.ismoving(axis)):
-                time.sleep(.05)
+            return self.wait_until_stopped(axis)
     
     def stp(self, axis):
         '''Stop the motor motion.'''
@@ -122,6 +220,12 @@ class mmc100:
         '''Set the motor deceleration [mm/s^2].'''
         self._exec_cmd(axis=axis, cmd='DEC', num=decel, query=False)
 
+    def get_motion(self, axis):
+        '''Read the motor speed [mm/s], acceleration and deceleration [mm/s^2]. Returns (vel, acc, dec).\n
+            Raises MMC100ReplyError if a reply is invalid.'''
+        with self.lock:
+            return tuple(parse_value(self._exec_cmd(axis=axis, cmd=cmd, query=True)) for cmd in ('VEL', 'ACC', 'DEC'))
+
     def set_zero(self, axis):
         '''Make current position the new zero position.'''
         self._exec_cmd(axis=axis, cmd='ZRO', num=None, query=False)
@@ -130,8 +234,25 @@ class mmc100:
         self._exec_cmd(axis=axis1, cmd='MSR', num=pos*math.sin(angledeg*math.pi/180), query=False)
         self._exec_cmd(axis=axis2, cmd='MSR', num=pos*math.cos(angledeg*math.pi/180), query=False)
         self._exec_cmd(axis=0, cmd='RUN', query=False)
-        while(self.ismoving(axis1) or self.ismoving(axis2)):
-            time.sleep(.05)
+        self._wait_stopped([axis1, axis2])
+
+    def mva_sync(self, positions, wait_stop = True):
+        '''Move several axes to absolute positions simultaneously (synchronized start).\n positions: dict of {axis: position [mm]}
+            With wait_stop, returns the settled status of the moved axes (see status).'''
+        for axis, pos in positions.items():
+            self._exec_cmd(axis=axis, cmd='MSA', num=pos, query=False)
+        self._exec_cmd(axis=0, cmd='RUN', query=False)
+        if(wait_stop):
+            return self._wait_stopped(list(positions))
+
+    def mvr_sync(self, steps, wait_stop = True):
+        '''Move several axes by relative amounts simultaneously (synchronized start).\n steps: dict of {axis: step [mm]}
+            With wait_stop, returns the settled status of the moved axes (see status).'''
+        for axis, step in steps.items():
+            self._exec_cmd(axis=axis, cmd='MSR', num=step, query=False)
+        self._exec_cmd(axis=0, cmd='RUN', query=False)
+        if(wait_stop):
+            return self._wait_stopped(list(steps))
             
     def read_err(self, axis):
       '''Read Error message and print it'''
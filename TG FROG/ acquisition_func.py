@@ -15,7 +15,20 @@ Parameters:
     start_pos/end_pos: starting/stopping position for the delay sweep
     step_size: step size taken by the motor during delay sweep. MMC100 highest resolution = 1 nm
     axis: the motor controller number. Since only one motor (one dimension) is used in my FROG experiments the axis # is always 1.
+    checkpoint: folder the scan progress is saved to every checkpoint_every columns, only the new columns are written
+                each time (see scan_checkpoint.py). A fresh scan clears it first.
+                An interrupted scan can be continued with resume_delay_stage(stage, spec).
+    resume: when TRUE the scan continues from the checkpoint folder instead of starting over.
+    publisher: optional stream_publisher.StreamPublisher, every spectrum is streamed as a COLUMN frame
+               (seq = column index, value = commanded position).
+    live: optional live_view.LiveSpectrogram that shows the spectrogram column by column while the sweep is running.
+    regrid: when TRUE the spectrogram is resampled from the measured encoder positions onto the commanded
+            (uniform) position grid before it is saved and plotted.
+Returns a time_zero.TimeZeroTracker with the measured temporal overlap (time_zero()) and a suggested window for the
+next scan (next_window()).
 
+The commanded position, the measured encoder position and the time stamp of every column are saved in positions.txt.
+The encoder position is read by the same poll that waits for the end of each move, so it adds no extra round trip.
 The data.txt file structure is as follows, where POS = position value, WAV = wavelegnth value, INT = intensity value
 
 0.0 POS POS POS POS ...\n
@@ -28,44 +41,104 @@ WAV INT INT INT INT ...\n
 .    .   .   .   .  ...\n
 
 """
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 import seabreeze # To read OceanOptics spectrometers
 seabreeze.use('pyseabreeze')
 from scipy.ndimage import gaussian_filter1d
+from scipy.interpolate import interp1d
+from stream_publisher import COLUMN, WAVELENGTHS
+from spectrogram_pyramid import SpectrogramPyramid, show
+from time_zero import TimeZeroTracker
+from scan_storage import ChunkedScanWriter, ScanReader
+from scan_checkpoint import CHECKPOINT_FILE, save_checkpoint, load_checkpoint, clear_checkpoint
+from motion_tuner import apply_profile, restore_motion
+from device_session import mark_scan
 
 
-def delay_stage(stage, spec, inttime, start_pos, end_pos, step_size, axis=1):
+def delay_stage(stage, spec, inttime, start_pos, end_pos, step_size, axis=1,
+                checkpoint=CHECKPOINT_FILE, checkpoint_every=50, resume=False, regrid=False, live=None, publisher=None):
   print 'starting aquisition'
   #*******Initialization*******
+  mark_scan(stage, spec) #start of the scan in a recorded session (see device_session.py)
   n = int(abs(start_pos-end_pos)/step_size + 1) #number of positions
   spec.integration_time_micros(inttime) #sets spectrometer's integration time
-  w = spec.wavelengths() #array of spectrometer wavelegnths
-  bg = spec.intensities() #array of background spectrum 
-  p = np.linspace(start_pos, end_pos, n) #array of delay positions
-  data = [[0]*len(p) for _ in range(len(w))] #initilizaes a matrix for spectrum data [len(w) x len(p)]
-                                             #every row corresponds to a wavelength and every column to a position
+  motion = apply_profile(stage, axis, step_size) #tuned velocity/acceleration for this step size, if there is one (see motion_tuner.py)
+  if resume: #continue an interrupted scan from its checkpoint
+    ck = load_checkpoint(checkpoint)
+    w = ck['w'] #wavelengths of the interrupted scan
+    p = ck['p'] #positions of the interrupted scan
+    col = int(ck['col']) #next unfinished column
+    data = np.zeros((len(w), len(p)))
+    data[:, :col] = ck['data'] #columns that were already acquired
+    enc = ck['enc'] #measured encoder positions of the interrupted scan
+    stamps = ck['stamps'] #time stamps of the interrupted scan
+    print 'resuming aquisition at column ' + str(col)
+    if col < n:
+      pos_now = stage.mva(axis, p[col]) #motor moves back to the next unfinished position
+  else:
+    clear_checkpoint(checkpoint) #the columns of an older scan must not end up in the new checkpoint
+    w = spec.wavelengths() #array of spectrometer wavelegnths
+    bg = spec.intensities() #array of background spectrum 
+    p = np.linspace(start_pos, end_pos, n) #array of delay positions
+    data = np.zeros((len(w), len(p))) #initilizaes a matrix for spectrum data [len(w) x len(p)]
+                                      #every row corresponds to a wavelength and every column to a position
+    enc = np.zeros(n) #measured encoder position of every column
+    stamps = np.zeros(n) #time stamp of every column
+    col = 0 #column index 
+    pos_now = stage.mva(axis, start_pos) #motor moves to starting position, returns the (theoretical, encoder) position
+  if publisher is not None:
+    publisher.publish(WAVELENGTHS, w)
+  pyramid = SpectrogramPyramid.for_scan(data) #multi-resolution levels for the final plot, built as the columns arrive
+  tracker = TimeZeroTracker(p) #finds the temporal overlap from the delay marginal
+  for c in range(col):
+    pyramid.add_column(c, data[:, c]) #columns of a resumed scan
+    tracker.add_column(c, data[:, c])
+  if live is not None:
+    live.start(w, p, data, col) #preallocates the live spectrogram (with the columns of a resumed scan)
 
   #*******Delay sweep*******
-  stage.mva(axis, start_pos) #motor moves to starting position
-  col = 0 #column index 
   while (col<n): 
+    stamps[col] = time.time()
     I = spec.intensities() #- bg #captures spectrum 
-    for i in range(len(w)): #adds intensities to data matrix
-      data[i][col] = I[i]
+    data[:, col] = I #adds intensities to data matrix
+    enc[col] = pos_now[1] #encoder position read when the previous move finished
+    pyramid.add_column(col, I)
+    tracker.add_column(col, I)
+    if live is not None:
+      live.add_column(col, I)
+    if publisher is not None:
+      publisher.publish(COLUMN, I, seq=col, value=p[col])
     col += 1
     print col #to keep track of how many positions are left in the sweep
-    stage.mvr(axis, step_size) #moves to the next position
+    if col % checkpoint_every == 0: #periodically saves the progress in case the scan gets interrupted
+      save_checkpoint(checkpoint, col, data, p, w, enc=enc, stamps=stamps, inttime=inttime, start_pos=start_pos,
+                      end_pos=end_pos, step_size=step_size, axis=axis, stage_pos=pos_now[1])
+    pos_now = stage.mvr(axis, step_size) #moves to the next position
+  clear_checkpoint(checkpoint) #the sweep is complete, the checkpoint is no longer needed
+  restore_motion(stage, axis, motion) #the velocity/acceleration set in the panel again
+  if live is not None:
+    live.finish()
   
-  mid = (start_pos+end_pos)/2 
-  stage.mva(axis, mid) #returns motor to the midpoint which I'm assuming is the temporal overlap point for the FROG
+  mid = tracker.time_zero() #measured temporal overlap point for the FROG
+  if mid is None: #no clear overlap in the scan, returns to the midpoint instead
+    mid = (start_pos+end_pos)/2 
+  print 'moving to time zero at ' + str(mid) + ' mm'
+  stage.mva(axis, mid) #returns motor to the temporal overlap point
   
   print 'Aquisition finished\n Data will now be saved\n\n'
   #*******Finalization*******
+  with open('positions.txt', 'w') as f: #commanded position, measured encoder position and time stamp of every column
+    np.savetxt(f, np.c_[p, enc, stamps], fmt = '%.6f', delimiter = ',', header = 'commanded [mm], encoder [mm], time [s]')
+  if regrid:
+    data = regrid_columns(data, enc, p) #spectrogram on the uniform grid, corrected for the following error
   with open('intensities.txt', 'w') as f:
     np.savetxt(f, data, fmt = '%.5f', delimiter = ',')
   
   intensities = np.array(data[:]) #makes a copy of the original data matrix which only contains the intensities
+  if regrid:
+    pyramid = SpectrogramPyramid.from_array(intensities) #levels of the regridded spectrogram
   p2 = p[:] #makes a copy of the original position array
 
   #Storing all of the data (wavelegnths are the first column, positions are the first row)
@@ -93,11 +166,10 @@ def delay_stage(stage, spec, inttime, start_pos, end_pos, step_size, axis=1):
   
   #plotting the 2D spectrogram
   plt.figure('Spectrogram')
-  X, Y = np.meshgrid(p2,w) #creates mesh of delay and wavelength
-  plt.pcolormesh(X, Y, intensities, cmap='hot', shading = 'nearest') #Y rows, X columns
+  im = show(plt.gca(), pyramid, p2, w) #draws only the pyramid level that matches the screen resolution, so zooming stays fast
   plt.title('Spectrogram', size = 20)
   plt.xlabel('Position [mm]', size = 18), plt.ylabel('Wavelength [nm]', size = 18)
-  plt.colorbar().ax.set_title('Intensity', size = 17)
+  plt.colorbar(im).ax.set_title('Intensity', size = 17)
   
   #plotting the approximate temporal pulse
   plt.figure('FWHM approximation')
@@ -120,6 +192,98 @@ def delay_stage(stage, spec, inttime, start_pos, end_pos, step_size, axis=1):
     plt.text(x = -200, y = 0.55, s = 'FWHM = '+ str(delay[idx][np.size(idx)-1]-delay[idx][0]) + ' fs\nBased on Gaussian filter', size = 15)
   
   plt.show()
+  return tracker
+
+
+def long_delay_stage(stage, spec, inttime, start_pos, end_pos, step_size, fname='scan_data', axis=1, dtype='uint16',
+                     block=256, compress=False, resume=False, publisher=None):
+  '''Delay sweep for very long scans (10^4 - 10^5 positions). The spectra are written in blocks of a small dtype to the
+     folder fname (see scan_storage.py) instead of being kept in memory, so memory use stays bounded. An interrupted
+     scan is continued from the stored columns with resume=True. The spectrogram is read back lazily for the plot.
+     Returns a time_zero.TimeZeroTracker, like delay_stage.'''
+  print 'starting long aquisition'
+  #*******Initialization*******
+  mark_scan(stage, spec) #start of the scan in a recorded session (see device_session.py)
+  spec.integration_time_micros(inttime) #sets spectrometer's integration time
+  motion = apply_profile(stage, axis, step_size) #tuned velocity/acceleration for this step size, if there is one (see motion_tuner.py)
+  if resume: #continue an interrupted scan from its store
+    writer = ChunkedScanWriter.reopen(fname)
+    w, p = writer.w, writer.p
+  else:
+    w = spec.wavelengths() #array of spectrometer wavelegnths
+    n = int(abs(start_pos-end_pos)/step_size + 1) #number of positions
+    p = np.linspace(start_pos, end_pos, n) #array of delay positions
+    writer = ChunkedScanWriter(fname, w, p, dtype=dtype, block=block, compress=compress)
+  n = len(p)
+  col = writer.next_col() #column index
+  tracker = TimeZeroTracker(p) #finds the temporal overlap from the delay marginal
+  pyramid = SpectrogramPyramid.for_scan((len(w), n)) #coarse levels for the final plot, the spectra themselves stay on disk
+  if col > 0: #marginal and coarse levels of the columns of a resumed scan, read block by block
+    reader = ScanReader(fname)
+    for c0 in range(0, writer.ncols, writer.block):
+      cols = reader.columns(c0, c0+writer.block)
+      tracker.marginal[c0:c0+writer.block] = np.sum(cols, axis=0)
+      for c in range(cols.shape[1]):
+        pyramid.add_column(c0+c, cols[:, c])
+    for c in range(writer.nbuf):
+      tracker.add_column(writer.ncols+c, writer.buf[c])
+      pyramid.add_column(writer.ncols+c, writer.buf[c])
+    print 'resuming aquisition at column ' + str(col)
+  if publisher is not None:
+    publisher.publish(WAVELENGTHS, w)
+  if col < n:
+    pos_now = stage.mva(axis, p[col]) #motor moves to the first position to acquire
+
+  #*******Delay sweep*******
+  while (col<n):
+    stamp = time.time()
+    I = spec.intensities() #captures spectrum
+    writer.add_column(I, pos_now[1], stamp) #written to disk every block columns
+    tracker.add_column(col, I)
+    pyramid.add_column(col, I)
+    if publisher is not None:
+      publisher.publish(COLUMN, I, seq=col, value=p[col])
+    col += 1
+    if col % writer.block == 0:
+      print col #to keep track of how many positions are left in the sweep
+    if col < n:
+      pos_now = stage.mvr(axis, step_size) #moves to the next position
+  writer.close()
+  restore_motion(stage, axis, motion) #the velocity/acceleration set in the panel again
+
+  mid = tracker.time_zero() #measured temporal overlap point for the FROG
+  if mid is None: #no clear overlap in the scan, returns to the midpoint instead
+    mid = (p[0]+p[-1])/2
+  print 'moving to time zero at ' + str(mid) + ' mm'
+  stage.mva(axis, mid)
+  print 'Aquisition finished\n Data is saved in ' + fname + '\n\n'
+
+  #plotting the 2D spectrogram, the fine levels are computed from the blocks of the viewed window only
+  pyramid.data = ScanReader(fname)
+  plt.figure('Spectrogram')
+  im = show(plt.gca(), pyramid, p, w)
+  plt.title('Spectrogram', size = 20)
+  plt.xlabel('Position [mm]', size = 18), plt.ylabel('Wavelength [nm]', size = 18)
+  plt.colorbar(im).ax.set_title('Intensity', size = 17)
+  plt.show()
+  return tracker
+
+
+def regrid_columns(data, measured, grid):
+  '''Resamples the columns of data, taken at the measured positions, onto grid (linear interpolation along each row).
+     Positions outside the measured range get the value of the closest measured column.'''
+  order = np.argsort(measured)
+  data = np.asarray(data)[:, order]
+  f = interp1d(measured[order], data, axis=1, bounds_error=False, fill_value=(data[:, 0], data[:, -1]))
+  return f(grid)
+
+
+def resume_delay_stage(stage, spec, checkpoint=CHECKPOINT_FILE, checkpoint_every=50, regrid=False, live=None, publisher=None):
+  '''Continues an interrupted delay sweep from its checkpoint folder. The scan parameters are read from the checkpoint.'''
+  ck = load_checkpoint(checkpoint)
+  return delay_stage(stage, spec, float(ck['inttime']), float(ck['start_pos']), float(ck['end_pos']), float(ck['step_size']),
+              axis=int(ck['axis']), checkpoint=checkpoint, checkpoint_every=checkpoint_every, resume=True,
+              regrid=regrid, live=live, publisher=publisher)
     
   
   
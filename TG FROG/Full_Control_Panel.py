@@ -20,11 +20,20 @@ import matplotlib.animation as animation
 import seabreeze # To read OceanOptics spectrometers
 seabreeze.use('pyseabreeze')
 import seabreeze.spectrometers as sb
-from acquisition_func import delay_stage # To run the delay sweep
+from acquisition_func import delay_stage, resume_delay_stage, long_delay_stage # To run (or continue) the delay sweep
+from live_view import LiveSpectrogram # To show the spectrogram while the sweep is running
+from stream_publisher import StreamPublisher, SPECTRUM, POSITION # To stream the readings to other processes
+from multi_spec import SpectrometerGroup, multi_delay_stage # To scan with all the connected spectrometers at once
+from device_session import SessionRecorder # To record the device traffic of the session
 
 #*******Initialization*******
 axis = 1 #controller number
-stage = mmc100.mmc100(port='COM3') #creates an MMC100 object and connects to the motor on COM3
+stream_port = None #set to a port number (e.g. 5555) to stream spectra, positions and scan columns to local subscribers
+record_session = None #set to a file name (e.g. 'session.rec') to record the motor and spectrometer traffic for offline replay
+stage = mmc100.mmc100(port='COM3', name='FROG delay') #creates an MMC100 object and connects to the motor on COM3
+recorder = SessionRecorder(record_session) if record_session else None #see device_session.py for the replay
+if recorder is not None:
+    recorder.stage(stage) #logs every command and reply from here on
 stage.set_vel(axis, 1) #set motor velocity mm/s, Minimum = 0.001 mm/s
 stage.set_acc(axis, 200) #set acceleration mm/s^2
 stage.set_dec(axis, 200) #set deceleration mm/s^2
@@ -36,10 +45,18 @@ time.sleep(1) #this is placed to prevent errors with the spectrometer
 spec = sb.Spectrometer(devices[0])  #makes a specrtometer instance
 time.sleep(0.5) #this is placed to prevent errors with the spectrometer
 spec.integration_time_micros(inttime)
-
-fig = Figure(figsize = (9,5),tight_layout = True)
-ax1 = fig.add_subplot(121) #for the position-time plot
-ax2 = fig.add_subplot(122) #for the spectrum plot
+other_specs = [sb.Spectrometer(d) for d in devices[1:]] #the other connected spectrometers, read in parallel in multi-spectrometer scans
+if recorder is not None: #the wrappers log every reading
+    spec = recorder.spectrometer(spec)
+    other_specs = [recorder.spectrometer(other) for other in other_specs]
+publisher = StreamPublisher(stream_port) if stream_port else None #see stream_subscriber.py for a client
+
+fig = Figure(figsize = (9,8),tight_layout = True)
+ax1 = fig.add_subplot(221) #for the position-time plot
+ax2 = fig.add_subplot(222) #for the spectrum plot
+ax3 = fig.add_subplot(223) #for the live spectrogram during a scan
+ax4 = fig.add_subplot(224) #for the live delay marginal during a scan
+live = LiveSpectrogram(ax3, ax4) #updated column by column by the scan function
 times = [] #for storing the time stamps of the position readings
 positions = []
 bg = spec.intensities() #background spectrum array
@@ -48,26 +65,40 @@ w = spec.wavelengths() #wavelength array
 #**********Start of GUI window************8
 root = tk.Tk() #creates a tkinter GUI window
 root.title('FROG Control Panel')
-root.geometry('1200x900') # (width pixels X height pixels)
+root.geometry('1200x1200') # (width pixels X height pixels)
    
 def animate(i): #plots two graphs
     t = time.time() - start_time
-    times.append(t)     #add current time stamp
-    positions.append(stage.get_pos(axis))  #add current motor position
+    try:
+        pos = stage.get_pos(axis)
+    except mmc100.MMC100ReplyError: #garbled or missing reply, skip this point
+        pos = None
+    if pos is not None:
+        times.append(t)     #add current time stamp
+        positions.append(pos)  #add current motor position
     ax1.clear(), ax2.clear()
     ax1.plot(times[-100:], positions[-100:]) #plot the last 100 points
     ax1.set_xlabel('Time [s]'), ax1.set_ylabel('Position [mm]')
     ax1.set_title("P-T graph")
     
     y = spec.intensities() #get current spectrometer reading
+    if publisher is not None:
+        publisher.publish(SPECTRUM, y)
     ax2.plot(w, y)
     ax2.set_xlabel('Wavelength [nm]'), ax2.set_ylabel('Intensity')
     ax2.set_title("Spectrum")
     ax2.set_xlim([200,1200]), ax2.set_ylim([-1000, 60000])
 
 def read_pos(): #reads realtime position 
-    pos_reading.set(str(stage.get_pos(axis))) #gets the current position from controller and writes it to a GUI window widget
-    root.after(50, read_pos) #calls itself every 50 ms
+    root.after(50, read_pos) #calls itself every 50 ms (scheduled first so a bad reply doesn't stop the updates)
+    try:
+        pos = stage.get_pos(axis) #gets the current position from controller
+    except mmc100.MMC100ReplyError:
+        pos_reading.set('no reply')
+        return
+    pos_reading.set(str(pos)) #writes it to a GUI window widget
+    if publisher is not None:
+        publisher.publish(POSITION, np.array([pos]), value=pos)
 
 def move_to(pos):
     stage.mva(axis, pos, wait_stop=False) 
@@ -85,6 +116,38 @@ def stop():
 def zero():
    stage.set_zero(axis)
 
+def scan_finished(tracker):
+  '''Called with the time zero tracker returned by a scan. Re-centers and narrows the scan window around the
+     measured overlap when the re-center box is checked.'''
+  t0 = tracker.time_zero()
+  if recenter.get() and t0 is not None:
+    start, end = tracker.next_window()
+    start_default.set('%.6f' % start)
+    end_default.set('%.6f' % end)
+    print('next scan window: ' + str(start) + ' to ' + str(end) + ' mm')
+
+def start_scan():
+  args = (stage, spec, float(inttime.get()), float(start_pos.get()), float(end_pos.get()), float(step_size.get()))
+  if all_specs.get() and other_specs: #one aligned dataset per spectrometer in multi_data.npz
+    inttimes = [float(t) for t in other_inttimes.get().split(',') if t.strip()] or [float(inttime.get())] #blank: same as the main one
+    inttimes = [float(inttime.get())] + (inttimes + inttimes[-1:]*len(other_specs))[:len(other_specs)] #last value repeated if too few are given
+    group = SpectrometerGroup([spec] + other_specs, inttimes)
+    try:
+      scan_finished(multi_delay_stage(stage, group, *args[3:], publisher=publisher))
+    finally:
+      group.close()
+  elif long_scan.get(): #spectra are written to disk in blocks instead of being kept in memory
+    scan_finished(long_delay_stage(*args, publisher=publisher))
+  else:
+    scan_finished(delay_stage(*args, live=live, publisher=publisher))
+
+def resume_scan():
+  if long_scan.get():
+    scan_finished(long_delay_stage(stage, spec, float(inttime.get()), float(start_pos.get()), float(end_pos.get()),
+                                   float(step_size.get()), resume=True, publisher=publisher))
+  else:
+    scan_finished(resume_delay_stage(stage, spec, live=live, publisher=publisher))
+
 def set_inttime():
   spec.integration_time_micros(float(inttime.get()))  
   
@@ -115,7 +178,11 @@ inc_default = tk.StringVar(root, value=str(0.01))
 inc = tk.Entry(root, textvariable = inc_default)
 
 pos_reading_label = tk.Label(root, text = 'Position (mm)')
-pos_reading = tk.StringVar(root, value=str(stage.get_pos(axis)))
+pos_reading = tk.StringVar(root, value='no reply')
+try:
+    pos_reading.set(str(stage.get_pos(axis)))
+except mmc100.MMC100ReplyError: #garbled or missing reply, read_pos tries again every 50 ms
+    pass
 curr_pos = tk.Label(root, textvariable= pos_reading)
 
 vel_label = tk.Label(root, text = 'Velocity [mm/s]') 
@@ -143,6 +210,9 @@ end_pos = tk.Entry(root, textvariable = end_default)
 step_label = tk.Label(root, text = 'Step Size [mm]:')
 step_default = tk.StringVar(root, value=str(0.004))
 step_size = tk.Entry(root, textvariable = step_default)
+other_inttimes_label = tk.Label(root, text = 'Other int. times [us]:') #comma separated, one per additional spectrometer
+other_inttimes_default = tk.StringVar(root, value=str(400000))
+other_inttimes = tk.Entry(root, textvariable = other_inttimes_default)
 
 #Button widgets
 Pos1GoBut= tk.Button(root, text= "Go", bg='green', command = lambda: move_to(float(pos1.get())))
@@ -155,8 +225,14 @@ inttimeBut = tk.Button(root, text = 'Set', command = set_inttime)
 velBut   = tk.Button(root, text = 'Set', command = set_vel)
 accelBut = tk.Button(root, text = 'Set', command = set_accel)
 decelBut = tk.Button(root, text = 'Set', command = set_decel)
-StartBut = tk.Button(root, text= 'Start Aquisition', bg='#1CAAEF', command = lambda: delay_stage(stage, spec,
-    float(inttime.get()), float(start_pos.get()), float(end_pos.get()), float(step_size.get())))
+StartBut = tk.Button(root, text= 'Start Aquisition', bg='#1CAAEF', command = start_scan)
+ResumeBut = tk.Button(root, text= 'Resume Aquisition', bg='#1CAAEF', command = resume_scan)
+recenter = tk.IntVar(root, value=0) #1: the next scan window is centered on the measured time zero
+recenterBox = tk.Checkbutton(root, text = 'Re-center window', variable = recenter)
+long_scan = tk.IntVar(root, value=0) #1: very long scan, stored in blocks on disk (see scan_storage.py)
+longScanBox = tk.Checkbutton(root, text = 'Long scan', variable = long_scan)
+all_specs = tk.IntVar(root, value=0) #1: the scan reads all the connected spectrometers in parallel (see multi_spec.py)
+allSpecsBox = tk.Checkbutton(root, text = 'All spectrometers (' + str(len(devices)) + ')', variable = all_specs)
 
 #Widget Layout (without this code the widgets won't be visible in the GUI window)
 pos1_label.grid(row = 0, column = 0)
@@ -195,6 +271,12 @@ end_pos.grid(row = 6, column = 3)
 step_label.grid(row = 6, column = 4)
 step_size.grid(row = 6, column = 5)
 StartBut.grid(row = 6, column = 6)
+ResumeBut.grid(row = 6, column = 7)
+recenterBox.grid(row = 6, column = 8)
+longScanBox.grid(row = 6, column = 9)
+other_inttimes_label.grid(row = 7, column = 0)
+other_inttimes.grid(row = 7, column = 1)
+allSpecsBox.grid(row = 7, column = 2)
 
 #Adding the matplotlib figure and toolbar to the GUI window
 canvas = FigureCanvasTkAgg(fig, root)
@@ -212,4 +294,10 @@ root.mainloop()
 
 stage.ser.close() #terminates communication with the motor
 spec.close()  #terminates communication with the spectrometer
+for other in other_specs:
+    other.close()
+if publisher is not None:
+    publisher.close() #disconnects the subscribers
+if recorder is not None:
+    recorder.close()
 
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Resampling of spectrograms onto uniform grids for FFT based processing. The spectrometer wavelength axis
+            (spec.wavelengths()) is not uniform in frequency and the measured positions are not exactly uniform in
+            delay, so the data has to be interpolated first. Instead of interpolating every trace again, a sparse
+            linear interpolation operator is built once per (source axis, ROI, target grid) and cached in memory
+            and on disk (CACHE_DIR), so resampling a whole spectrogram is a single sparse matrix product.
+To make use of it (intensities is the [len(w) x len(p)] matrix saved by the scan functions):\n
+    f, S = grid_transform.to_frequency(intensities, w, roi=(543, 654))\n
+    delay, S = grid_transform.to_delay(S, p)
+
+Units: wavelength [nm], frequency [PHz], position [mm], delay [fs].
+The wavelength -> frequency operator includes the Jacobian |dw/df| = w^2/c, so S(f) df = S(w) dw.
+"""
+import os
+import hashlib
+import numpy as np
+from scipy import sparse
+
+C_NM_PHZ = 299.792458 #speed of light [nm*PHz]
+C = 3e8 #speed of light [m/s], same value as used for the delay axis in the scan functions
+CACHE_DIR = 'grid_cache' #folder for the cached operators (in the working directory)
+_cache = {} #in memory cache {key: (operator, grid)}
+CACHE_VERSION = b'2' #part of the key, changed when the operators are built differently so old cache files aren't used
+
+
+def position_to_delay(p):
+    '''Converts stage positions [mm] to delay [fs]. Multiply by 2 since twice the distance is added to the path length.'''
+    return np.asarray(p)*2/(1000*C)*1e15
+
+
+def interp_matrix(x_src, x_dst):
+    '''Returns the sparse matrix M [len(x_dst) x len(x_src)] of linear interpolation, i.e. y(x_dst) = M.dot(y(x_src)).
+        x_src does not have to be sorted. Repeated x_src values (e.g. the encoder reading the same position twice) are
+        averaged. Points of x_dst outside the range of x_src get 0.'''
+    x_src = np.asarray(x_src, dtype=float)
+    x_dst = np.asarray(x_dst, dtype=float)
+    order = np.argsort(x_src, kind='mergesort')
+    xs, counts = np.unique(x_src[order], return_counts=True) #sorted distinct source points
+    groups = np.repeat(np.arange(len(xs)), counts) #distinct point of every sorted source point
+    average = sparse.csr_matrix((1.0/counts[groups], (groups, order)), shape=(len(xs), len(x_src)))
+    inside = (x_dst >= xs[0]) & (x_dst <= xs[-1])
+    rows = np.nonzero(inside)[0]
+    if len(xs) == 1: #a single distinct point, only targets exactly on it get a value
+        M = sparse.csr_matrix((np.ones(len(rows)), (rows, np.zeros(len(rows), dtype=int))), shape=(len(x_dst), 1))
+        return M.dot(average).tocsr()
+    j = np.clip(np.searchsorted(xs, x_dst, side='right') - 1, 0, len(xs)-2) #left neighbour of every target point
+    t = (x_dst - xs[j])/(xs[j+1] - xs[j]) #fractional distance to the right neighbour
+    j, t = j[inside], t[inside]
+    M = sparse.csr_matrix((np.r_[1-t, t], (np.r_[rows, rows], np.r_[j, j+1])), shape=(len(x_dst), len(xs)))
+    return M.dot(average).tocsr()
+
+
+def _key(*arrays):
+    h = hashlib.sha1(CACHE_VERSION)
+    for a in arrays:
+        a = np.ascontiguousarray(a, dtype=float)
+        h.update(str(a.shape).encode('ascii'))
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def _cached(key, build, cache_dir):
+    '''Returns the (operator, grid) for key from memory, from disk, or builds and stores it.'''
+    if key in _cache:
+        return _cache[key]
+    fname = os.path.join(cache_dir, key + '.npz') if cache_dir else None
+    if fname and os.path.exists(fname):
+        with np.load(fname) as f:
+            M = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            grid = f['grid']
+    else:
+        M, grid = build()
+        M = M.tocsr()
+        if fname:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(fname, 'wb') as f:
+                np.savez(f, data=M.data, indices=M.indices, indptr=M.indptr, shape=M.shape, grid=grid)
+    _cache[key] = (M, grid)
+    return M, grid
+
+
+def frequency_operator(w, roi=None, n=None, cache_dir=CACHE_DIR):
+    '''Returns (M, f): the operator from the wavelength pixels w[roi[0]:roi[1]] to a uniform frequency grid f [PHz]
+        with n points (default: number of ROI pixels), Jacobian included.'''
+    w = np.asarray(w, dtype=float)
+    i0, i1 = roi if roi is not None else (0, len(w))
+    n = n or (i1 - i0)
+    def build():
+        wr = w[i0:i1]
+        f_src = C_NM_PHZ/wr
+        f = np.linspace(f_src.min(), f_src.max(), n)
+        return interp_matrix(f_src, f).dot(sparse.diags(wr**2/C_NM_PHZ)), f
+    return _cached(_key(w, [i0, i1, n]), build, cache_dir)
+
+
+def delay_operator(p, n=None, cache_dir=CACHE_DIR):
+    '''Returns (M, delay): the operator from the (measured) positions p [mm] to a uniform delay grid [fs] with
+        n points (default: len(p)).'''
+    p = np.asarray(p, dtype=float)
+    n = n or len(p)
+    def build():
+        d_src = position_to_delay(p)
+        delay = np.linspace(d_src.min(), d_src.max(), n)
+        return interp_matrix(d_src, delay), delay
+    return _cached(_key(p, [n]), build, cache_dir)
+
+
+def to_frequency(spectrogram, w, roi=None, n=None, cache_dir=CACHE_DIR):
+    '''Resamples a [len(w) x ncols] spectrogram onto a uniform frequency grid. Returns (f, spectrogram on f).'''
+    M, f = frequency_operator(w, roi, n, cache_dir)
+    i0 = roi[0] if roi is not None else 0
+    return f, M.dot(np.asarray(spectrogram)[i0:i0+M.shape[1]])
+
+
+def to_delay(spectrogram, p, n=None, cache_dir=CACHE_DIR):
+    '''Resamples the columns of a [nrows x len(p)] spectrogram onto a uniform delay grid. Returns (delay, spectrogram on delay).'''
+    M, delay = delay_operator(p, n, cache_dir)
+    return delay, M.dot(np.asarray(spectrogram).T).T
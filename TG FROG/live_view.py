@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Live spectrogram shown in the control panel while a scan is running. The image is preallocated for the
+            whole scan and every new spectrum is written into its column in place, then only the image and the delay
+            marginal are redrawn with blitting (no new pcolormesh per column). Like the final plot, every row and
+            column is drawn at its own wavelength and position, since the wavelength axis is not uniform.
+            The scan functions call start() once,
+            add_column() for every acquired spectrum and finish() at the end of the scan.
+To make use of it, pass two axes of the control panel figure (after the FigureCanvasTkAgg has been created):\n
+    live = live_view.LiveSpectrogram(ax3, ax4)\n
+    delay_stage(stage, spec, ..., live=live)
+"""
+import numpy as np
+from matplotlib.image import NonUniformImage
+
+
+class LiveSpectrogram:
+    def __init__(self, ax_img, ax_marg):
+        '''ax_img: axes for the spectrogram image, ax_marg: axes for the running marginal (spectrum summed over wavelength).'''
+        self.ax_img = ax_img
+        self.ax_marg = ax_marg
+
+    def start(self, w, p, data=None, ncols=0):
+        '''Preallocates the image for a scan over the positions p.\n
+            data/ncols: spectra that were already acquired (e.g. when a scan is resumed), the first ncols columns are shown.'''
+        self.canvas = self.ax_img.figure.canvas
+        self.img = np.full((len(w), len(p)), np.nan) #nan columns are not acquired yet and stay blank
+        self.marginal = np.full(len(p), np.nan)
+        self.vmin, self.vmax = np.inf, -np.inf
+
+        self.ax_img.clear(), self.ax_marg.clear()
+        #NonUniformImage needs increasing coordinates, the image is flipped where the axes decrease
+        self.flip_p = 1 if len(p) < 2 or p[0] <= p[-1] else -1
+        self.flip_w = 1 if len(w) < 2 or w[0] <= w[-1] else -1
+        self.p, self.w = np.asarray(p, dtype=float)[::self.flip_p], np.asarray(w, dtype=float)[::self.flip_w]
+        self.image = NonUniformImage(self.ax_img, cmap='hot', interpolation='nearest', animated=True)
+        self.image.set_clim(0, 1)
+        self._set_image()
+        self.ax_img.add_image(self.image)
+        self.ax_img.set_xlim(p[0], p[-1]), self.ax_img.set_ylim(w[0], w[-1])
+        self.ax_img.set_xlabel('Position [mm]'), self.ax_img.set_ylabel('Wavelength [nm]')
+        self.ax_img.set_title('Live Spectrogram')
+        self.line, = self.ax_marg.plot(p, self.marginal, animated=True)
+        self.ax_marg.set_xlim(min(p[0], p[-1]), max(p[0], p[-1])), self.ax_marg.set_ylim(0, 1.05)
+        self.ax_marg.set_xlabel('Position [mm]'), self.ax_marg.set_ylabel('Normalized Intensity')
+        self.ax_marg.set_title('Delay Marginal')
+
+        self.canvas.draw() #draws everything except the animated artists
+        self.bg_img = self.canvas.copy_from_bbox(self.ax_img.bbox) #backgrounds that are restored before each blit
+        self.bg_marg = self.canvas.copy_from_bbox(self.ax_marg.bbox)
+        for col in range(ncols):
+            self._update(col, data[:, col])
+        self._blit()
+
+    def add_column(self, col, I):
+        '''Writes the spectrum I into column col and redraws the image and marginal.'''
+        self._update(col, I)
+        self._blit()
+
+    def finish(self):
+        '''Called at the end of the scan. Makes the image a normal artist so it stays visible when the figure is redrawn.'''
+        self.image.set_animated(False)
+        self.line.set_animated(False)
+        self.canvas.draw()
+
+    def _update(self, col, I):
+        self.img[:, col] = I
+        self.marginal[col] = np.sum(I)
+        self.vmin, self.vmax = min(self.vmin, np.min(I)), max(self.vmax, np.max(I)) #running color scale
+        if self.vmax > self.vmin:
+            self.image.set_clim(self.vmin, self.vmax)
+        self._set_image()
+        marg = self.marginal - np.nanmin(self.marginal)
+        if np.nanmax(marg) > 0:
+            marg = marg/np.nanmax(marg) #normalization
+        self.line.set_ydata(marg)
+
+    def _set_image(self):
+        self.image.set_data(self.p, self.w, self.img[::self.flip_w, ::self.flip_p])
+
+    def _blit(self):
+        self.canvas.restore_region(self.bg_img)
+        self.ax_img.draw_artist(self.image)
+        self.canvas.blit(self.ax_img.bbox)
+        self.canvas.restore_region(self.bg_marg)
+        self.ax_marg.draw_artist(self.line)
+        self.canvas.blit(self.ax_marg.bbox)
+        self.canvas.get_tk_widget().update_idletasks() #shows the new frame without running the other GUI callbacks
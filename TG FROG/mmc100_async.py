@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Description: asyncio version of the mmc100 class (requires Python 3). The serial port is opened in non-blocking mode
+            (timeout=0) and replies are collected without ever blocking the event loop, so one event loop can keep
+            the motor, the spectrometer (run in an executor with read_spectrum), a disk writer and a UI busy at the
+            same time without a thread per device. The replies are parsed with the same parsers as mmc100.py.
+To make use of it, open the motor from inside a coroutine:\n
+    stage = await mmc100_async.AsyncMMC100.open(port)\n
+    await stage.mva(1, 0.5)\n
+    I = await mmc100_async.read_spectrum(spec)
+"""
+import asyncio
+import time
+import serial
+from mmc100 import parse_pos, parse_sta, _axis_status, MMC100ReplyError, STA_STOPPED
+
+
+class AsyncMMC100:
+    def __init__(self, port, timeout=0.5):
+        '''Opens the port. Use AsyncMMC100.open() instead, which also probes the axes and sets closed loop mode.'''
+        self.ser = serial.Serial(port, timeout=0, write_timeout=0, baudrate=38400) #non-blocking port
+        self.ser.reset_input_buffer()
+        self.timeout = timeout #reply timeout [s], same as the blocking driver
+        self.lock = asyncio.Lock() #one exchange at a time on the serial line
+        self.buf = bytearray() #received bytes that are not part of a returned reply yet
+        self.axes = []
+
+    @classmethod
+    async def open(cls, port, timeout=0.5):
+        '''Creates an AsyncMMC100 instance, probes the axes and sets them to closed loop mode.'''
+        self = cls(port, timeout)
+        await self.probe_axes()
+        for axis in (1, 2, 3, 4):
+            await self.set_cl(axis)
+        return self
+
+    def close(self):
+        self.ser.close()
+
+    async def _readline(self):
+        '''Reads one reply line without blocking the event loop. Returns what arrived so far (b'' if nothing) on timeout,
+            like serial.readline. Bytes after the line (the next replies of a batch) stay in the buffer.'''
+        deadline = time.time() + self.timeout
+        while b'\n' not in self.buf:
+            data = self.ser.read(self.ser.in_waiting or 1)
+            if data:
+                self.buf += data
+            elif time.time() > deadline:
+                line, self.buf = bytes(self.buf), bytearray()
+                return line
+            else:
+                await asyncio.sleep(.002) #lets the other tasks run while the controller answers
+        end = self.buf.index(b'\n') + 1
+        line = bytes(self.buf[:end])
+        del self.buf[:end]
+        return line
+
+    async def _write(self, cmd_full):
+        self.ser.reset_input_buffer()
+        self.buf = bytearray() #drops stale replies
+        self.ser.write(bytearray(cmd_full, 'ascii'))
+        while self.ser.out_waiting: #non-blocking flush
+            await asyncio.sleep(.001)
+
+    async def _exec_cmd(self, axis, cmd, num=None, query=False):
+        '''Sends a command to the controller, see mmc100._exec_cmd.'''
+        cmd_full = str(axis)+cmd
+        if num is not None:
+            cmd_full += '{0:.3f}'.format(num)
+        if query:
+            cmd_full += '?'
+        cmd_full += '\n\r'
+        async with self.lock:
+            await self._write(cmd_full)
+            if query:
+                return await self._readline()
+
+    async def _exec_batch(self, cmds):
+        '''Sends several query commands in a single write and reads back one reply per command, see mmc100._exec_batch.'''
+        cmd_full = ''.join(str(axis)+cmd+'?\n\r' for axis, cmd in cmds)
+        async with self.lock:
+            await self._write(cmd_full)
+            return [await self._readline() for _ in cmds]
+
+    async def probe_axes(self):
+        self.axes = []
+        for ind in range(1, 9, 1):
+            if len(await self._exec_cmd(ind, 'VER', query=True)) > 0:
+                self.axes.append(ind)
+
+    async def get_pos(self, axis):
+        '''Get the motor's theoretical position in [mm]. Raises MMC100ReplyError if the reply is invalid.'''
+        return parse_pos(await self._exec_cmd(axis, 'POS', query=True))[0]
+
+    async def ismoving(self, axis):
+        '''Check if motor is in motion. Returns TRUE if it is.'''
+        return not parse_sta(await self._exec_cmd(axis, 'STA', query=True)) & STA_STOPPED
+
+    async def status(self, axes=None):
+        '''Position, moving state and error flags of several axes in one batched exchange, see mmc100.status.'''
+        if axes is None:
+            axes = self.axes
+        cmds = []
+        for axis in axes:
+            cmds += [(axis, 'STA'), (axis, 'POS')]
+        replies = await self._exec_batch(cmds)
+        return dict((axis, _axis_status(replies[2*k], replies[2*k+1])) for k, axis in enumerate(axes))
+
+    async def wait_until_stopped(self, axis, retries=3):
+        '''Polls the axis until it stops and returns the settled (theoretical, encoder) position.
+            Other tasks keep running between the polls.'''
+        failed = 0
+        while True:
+            try:
+                st = (await self.status([axis]))[axis]
+                failed = 0
+            except MMC100ReplyError:
+                failed += 1
+                if failed > retries:
+                    raise
+                continue
+            if not st.moving:
+                return st.theoretical, st.encoder
+            await asyncio.sleep(.05)
+
+    async def mva(self, axis, pos, wait_stop=True):
+        '''Move the motor to an absolute position. With wait_stop, returns the settled (theoretical, encoder) position.'''
+        await self._exec_cmd(axis, 'MVA', num=pos)
+        if wait_stop:
+            return await self.wait_until_stopped(axis)
+
+    async def mvr(self, axis, pos, wait_stop=True):
+        '''Move the motor to a relative position. With wait_stop, returns the settled (theoretical, encoder) position.'''
+        await self._exec_cmd(axis, 'MVR', num=pos)
+        if wait_stop:
+            return await self.wait_until_stopped(axis)
+
+    async def stp(self, axis):
+        '''Stop the motor motion.'''
+        await self._exec_cmd(axis, 'STP')
+
+    async def set_vel(self, axis, vel):
+        '''Set the motor speed [mm/s].'''
+        await self._exec_cmd(axis, 'VEL', num=vel)
+
+    async def set_acc(self, axis, accel):
+        '''Set the motor acceleration [mm/s^2].'''
+        await self._exec_cmd(axis, 'ACC', num=accel)
+
+    async def set_dec(self, axis, decel):
+        '''Set the motor deceleration [mm/s^2].'''
+        await self._exec_cmd(axis, 'DEC', num=decel)
+
+    async def set_cl(self, axis):
+        '''Set motor to closed loop mode.'''
+        await self._exec_cmd(axis, 'FBK3')
+
+
+async def read_spectrum(spec, executor=None):
+    '''Reads a spectrum in an executor thread (the seabreeze call blocks), so the event loop keeps running meanwhile.'''
+    return await asyncio.get_running_loop().run_in_executor(executor, spec.intensities)
+
+
+async def delay_scan(stage, spec, positions, axis=1, on_column=None, executor=None):
+    '''Steps through positions and takes a spectrum at each one.\n
+        on_column: optional callback (col, position, encoder position, spectrum) for saving/plotting a column. It runs in
+        the executor while the stage already moves to the next position, so it never adds to the scan time.
+        Returns the list of spectra.'''
+    loop = asyncio.get_running_loop()
+    spectra = []
+    pending = None #the on_column call of the previous column
+    theo, enc = await stage.mva(axis, positions[0])
+    for col in range(len(positions)):
+        I = await read_spectrum(spec, executor)
+        spectra.append(I)
+        if pending is not None:
+            await pending
+        if on_column is not None:
+            pending = loop.run_in_executor(executor, on_column, col, positions[col], enc, I)
+        if col+1 < len(positions):
+            theo, enc = await stage.mva(axis, positions[col+1])
+    if pending is not None:
+        await pending
+    return spectra
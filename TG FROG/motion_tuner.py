@@ -0,0 +1,162 @@
+'''
+Description: Calibration of the MMC100 motion parameters (velocity, acceleration, deceleration) for a given step size.
+            Every combination of the given values is tried by stepping back and forth a few times. Each step is
+            followed with batched STA?/POS? polls (mmc100.poll_status), which gives:
+                move time: from the move command until the controller reports the axis stopped
+                settle time: from then until the encoder position is within tol of the target
+                following error: largest difference between the theoretical and the encoder position during the move
+            The fastest combination (move + settle time) that settles, stays within the following error limit and
+            raises no error or limit flag is stored as the profile of that step size in PROFILE_FILE, under the
+            name of the stage (mmc100 name, e.g. 'FROG delay') and the axis, so a profile tuned on one stage is
+            never applied to another. The scan functions call apply_profile at the start of a scan, so a tuned
+            step size is stepped with its profile instead of the values set by hand in the control panel, and
+            restore_motion at the end, so the panel values are in effect again for the manual moves.
+To make use of it:\n
+    import motion_tuner\n
+    best, results = motion_tuner.tune(stage, 1, 0.004, vels=[0.5, 1, 2], accs=[50, 200, 500])\n
+    previous = motion_tuner.apply_profile(stage, 1, 0.004)\n
+    ... scan ...\n
+    motion_tuner.restore_motion(stage, 1, previous)
+
+PROFILE_FILE holds {'<stage name> axis <axis>': {step size string: profile}}.
+'''
+import json
+import math
+import os
+import time
+import mmc100
+
+PROFILE_FILE = 'motion_profiles.json' #tuned profiles {step size: profile} (in the working directory)
+
+
+def measure_step(stage, axis, step, tol=0.0005, poll=0.005, timeout=10.0):
+    '''Moves the axis by step with the current motion parameters and follows the move.\n
+        tol: the axis counts as settled when the encoder is within tol [mm] of the target
+        poll: time between two STA?/POS? polls [s]
+        Returns a dict with move_time, settle_time [s], following_error, final_error [mm], settled and flags
+        (True if the controller reported an error or a limit switch during the move).'''
+    target = stage.poll_status(axis)[1] + step
+    following, flags = 0.0, False
+    t0 = time.time()
+    stage.mvr(axis, step, wait_stop=False)
+    while True: #until the controller reports the axis stopped
+        st = stage.status([axis])[axis]
+        following = max(following, abs(st.theoretical - st.encoder))
+        flags = flags or st.error or st.pos_limit or st.neg_limit
+        if not st.moving or time.time() - t0 > timeout:
+            break
+        time.sleep(poll)
+    t_stop = time.time()
+    while abs(st.encoder - target) > tol and time.time() - t0 < timeout: #until the encoder reaches the target
+        time.sleep(poll)
+        st = stage.status([axis])[axis]
+    t_settled = time.time()
+    return dict(move_time=t_stop - t0, settle_time=t_settled - t_stop, following_error=following,
+                final_error=abs(st.encoder - target), settled=abs(st.encoder - target) <= tol, flags=flags)
+
+
+def tune(stage, axis, step, vels, accs, decs=None, repeats=3, tol=0.0005, max_following=None, fname=PROFILE_FILE):
+    '''Tries every combination of vels x accs x decs (decs=None: deceleration = acceleration) for the step size step [mm].
+        Each combination does repeats steps forward and back, so the stage ends where it started (it is moved back
+        to the start if a combination fails halfway). The motion parameters the axis had before are set again at the end.
+        max_following: largest accepted following error [mm] (default: no limit)
+        Stores and returns the best profile (None if no combination passed) and the list of all measured results.'''
+    results = []
+    previous = stage.get_motion(axis) #(vel, acc, dec) set again when tuning is done
+    start = stage.get_pos(axis)
+    try:
+        for vel in vels:
+            for acc in accs:
+                for dec in (decs if decs is not None else [acc]):
+                    res = _try_combination(stage, axis, step, vel, acc, dec, repeats, tol, start)
+                    if res is None: #counts as a failed combination
+                        continue
+                    if max_following is not None and res['following_error'] > max_following:
+                        res['ok'] = False
+                    results.append(res)
+                    print('vel %g, acc %g, dec %g: move %.3f s, settle %.3f s, following error %.4f mm%s' % (
+                        vel, acc, dec, res['move_time'], res['settle_time'], res['following_error'],
+                        '' if res['ok'] else ' (rejected)'))
+    finally:
+        restore_motion(stage, axis, previous)
+    passed = [r for r in results if r['ok']]
+    if not passed:
+        return None, results
+    best = min(passed, key=lambda r: r['move_time'] + r['settle_time']) #the slowest of the steps counts
+    profile = dict((key, best[key]) for key in ('vel', 'acc', 'dec', 'move_time', 'settle_time', 'following_error'))
+    profiles = load_profiles(fname)
+    profiles.setdefault(_stage_key(stage, axis), {})['%g' % abs(step)] = profile
+    with open(fname, 'w') as f:
+        json.dump(profiles, f, indent=1, sort_keys=True)
+    return profile, results
+
+
+def _try_combination(stage, axis, step, vel, acc, dec, repeats, tol, start):
+    '''Steps forward and back repeats times with the given motion parameters. Returns the measured result, or None
+        (after moving back to start) if a reply was invalid.'''
+    stage.set_vel(axis, vel)
+    stage.set_acc(axis, acc)
+    stage.set_dec(axis, dec)
+    steps = []
+    try:
+        for k in range(2*repeats):
+            steps.append(measure_step(stage, axis, step if k % 2 == 0 else -step, tol))
+    except mmc100.MMC100ReplyError as e:
+        print('vel %g, acc %g, dec %g: %s' % (vel, acc, dec, e))
+        stage.wait_until_stopped(axis)
+        stage.mva(axis, start) #the steps left out would have brought the stage back
+        return None
+    return dict(vel=vel, acc=acc, dec=dec,
+                move_time=max(s['move_time'] for s in steps),
+                settle_time=max(s['settle_time'] for s in steps),
+                following_error=max(s['following_error'] for s in steps),
+                ok=all(s['settled'] and not s['flags'] for s in steps))
+
+
+def _stage_key(stage, axis):
+    return '%s axis %d' % (stage.name, axis)
+
+
+def load_profiles(fname=PROFILE_FILE):
+    '''Returns the stored profiles as {'<stage name> axis <axis>': {step size string: profile}}, empty if nothing
+        was tuned yet.'''
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+
+def best_profile(stage, axis, step, fname=PROFILE_FILE, max_ratio=2.0):
+    '''Returns the profile of the stage axis for the stored step size closest to step (at most max_ratio larger or
+        smaller), or None.'''
+    profiles = load_profiles(fname).get(_stage_key(stage, axis), {})
+    step = abs(step)
+    if not profiles or step == 0:
+        return None
+    key = min(profiles, key=lambda k: abs(math.log(float(k)/step)))
+    if abs(math.log(float(key)/step)) > math.log(max_ratio):
+        return None
+    return profiles[key]
+
+
+def apply_profile(stage, axis, step, fname=PROFILE_FILE):
+    '''Sets the tuned velocity, acceleration and deceleration for step if a matching profile exists.
+        Returns the previous (vel, acc, dec) to pass to restore_motion, or None if there is no profile
+        (the motion parameters are left unchanged).'''
+    profile = best_profile(stage, axis, step, fname)
+    if profile is None:
+        return None
+    previous = stage.get_motion(axis)
+    stage.set_vel(axis, profile['vel'])
+    stage.set_acc(axis, profile['acc'])
+    stage.set_dec(axis, profile['dec'])
+    print('motion profile: vel %g, acc %g, dec %g' % (profile['vel'], profile['acc'], profile['dec']))
+    return previous
+
+
+def restore_motion(stage, axis, previous):
+    '''Sets the (vel, acc, dec) returned by get_motion or apply_profile again. Does nothing if previous is None.'''
+    if previous is not None:
+        stage.set_vel(axis, previous[0])
+        stage.set_acc(axis, previous[1])
+        stage.set_dec(axis, previous[2])
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Acquisition with several OceanOptics spectrometers at once (e.g. the FROG spectrometer plus a second one
+            for the reference arm / fundamental spectrum). Every spectrometer has its own reader thread, read()
+            triggers all of them at the same time and waits for the results, so taking the spectra at one position
+            takes as long as the slowest device instead of the sum of all of them. Each device keeps its own
+            integration time and wavelength axis.
+To make use of it:\n
+    group = multi_spec.SpectrometerGroup([spec1, spec2], [400000, 10000])\n
+    spectra = group.read()\n
+    multi_spec.multi_delay_stage(stage, group, start_pos, end_pos, step_size)
+Parameters of multi_delay_stage:
+    stage: an mmc100 class object
+    group: a SpectrometerGroup
+    start_pos/end_pos: starting/stopping position for the delay sweep
+    step_size: step size taken by the motor during delay sweep
+    fname: the .npz file all the datasets are saved to
+    axis: the motor controller number
+
+The .npz file contains the aligned datasets of all devices, where NAME is the name of the device (its serial number):
+    names: the device names
+    p, enc, stamps: commanded position, measured encoder position and time stamp of every column
+    w_NAME: wavelengths of the device
+    data_NAME: [len(w_NAME) x len(p)] intensities of the device
+    inttime_NAME: integration time of the device [us]
+"""
+import threading
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+try:
+    import queue
+except ImportError: #python 2
+    import Queue as queue
+from time_zero import TimeZeroTracker
+from spectrogram_pyramid import SpectrogramPyramid, show
+from stream_publisher import COLUMN, WAVELENGTHS
+from motion_tuner import apply_profile, restore_motion
+from device_session import mark_scan
+
+
+class _Reader(threading.Thread):
+    '''Reader thread of one spectrometer, takes a spectrum every time it is triggered.'''
+    def __init__(self, spec):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.spec = spec
+        self.trigger = queue.Queue()
+        self.result = queue.Queue()
+        self.start()
+
+    def run(self):
+        while self.trigger.get() is not None:
+            try:
+                self.result.put((True, self.spec.intensities()))
+            except Exception as e:
+                self.result.put((False, e))
+
+
+class SpectrometerGroup:
+    def __init__(self, specs, inttimes, names=None):
+        '''specs: list of spectrometer objects, inttimes: integration time of each one [us],
+            names: names of the datasets (default: the serial numbers).'''
+        self.specs = specs
+        self.names = names if names is not None else [str(s.serial_number) for s in specs]
+        self.inttimes = list(inttimes)
+        for spec, t in zip(specs, inttimes):
+            spec.integration_time_micros(t)
+        self.w = [spec.wavelengths() for spec in specs]
+        self.readers = [_Reader(spec) for spec in specs]
+
+    def set_inttime(self, i, inttime):
+        '''Sets the integration time of device i [us].'''
+        self.specs[i].integration_time_micros(inttime)
+        self.inttimes[i] = inttime
+
+    def read(self):
+        '''Takes a spectrum with every device in parallel. Returns the list of spectra.'''
+        for reader in self.readers:
+            reader.trigger.put(True)
+        results = [reader.result.get() for reader in self.readers]
+        for ok, value in results:
+            if not ok:
+                raise value
+        return [value for ok, value in results]
+
+    def close(self):
+        '''Stops the reader threads (the spectrometers themselves are not closed).'''
+        for reader in self.readers:
+            reader.trigger.put(None)
+
+
+def multi_delay_stage(stage, group, start_pos, end_pos, step_size, fname='multi_data.npz', axis=1, publisher=None):
+    print('starting multi-spectrometer aquisition')
+    #*******Initialization*******
+    mark_scan(stage, *group.specs) #start of the scan in a recorded session (see device_session.py)
+    n = int(abs(start_pos-end_pos)/step_size + 1) #number of positions
+    p = np.linspace(start_pos, end_pos, n) #array of delay positions
+    data = [np.zeros((len(w), n)) for w in group.w] #one intensity matrix per device
+    enc = np.zeros(n) #measured encoder position of every column
+    stamps = np.zeros(n) #time stamp of every column
+    tracker = TimeZeroTracker(p) #time zero from the first device
+    motion = apply_profile(stage, axis, step_size) #tuned velocity/acceleration for this step size, if there is one
+    if publisher is not None:
+        publisher.publish(WAVELENGTHS, group.w[0])
+
+    #*******Delay sweep*******
+    pos_now = stage.mva(axis, start_pos) #motor moves to starting position
+    for col in range(n):
+        stamps[col] = time.time()
+        spectra = group.read() #all the devices at once
+        for d, I in zip(data, spectra):
+            d[:, col] = I
+        enc[col] = pos_now[1]
+        tracker.add_column(col, spectra[0])
+        if publisher is not None:
+            publisher.publish(COLUMN, spectra[0], seq=col, value=p[col])
+        print(col+1) #to keep track of how many positions are left in the sweep
+        if col+1 < n:
+            pos_now = stage.mvr(axis, step_size) #moves to the next position
+    restore_motion(stage, axis, motion) #the velocity/acceleration set in the panel again
+
+    mid = tracker.time_zero() #measured temporal overlap point
+    if mid is None: #no clear overlap in the scan, returns to the midpoint instead
+        mid = (start_pos+end_pos)/2
+    stage.mva(axis, mid)
+    print('Aquisition finished\n Data will now be saved\n\n')
+
+    #*******Finalization*******
+    datasets = {}
+    for name, w, d, t in zip(group.names, group.w, data, group.inttimes):
+        datasets['w_' + name], datasets['data_' + name], datasets['inttime_' + name] = w, d, t
+    with open(fname, 'wb') as f:
+        np.savez(f, names=np.array(group.names), p=p, enc=enc, stamps=stamps, **datasets)
+
+    for name, w, d in zip(group.names, group.w, data): #one spectrogram per device
+        plt.figure('Spectrogram ' + name)
+        im = show(plt.gca(), SpectrogramPyramid.from_array(d), p, w)
+        plt.title('Spectrogram ' + name, size = 20)
+        plt.xlabel('Position [mm]', size = 18), plt.ylabel('Wavelength [nm]', size = 18)
+        plt.colorbar(im).ax.set_title('Intensity', size = 17)
+    plt.show()
+    return tracker
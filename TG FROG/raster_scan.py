@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Multi-axis raster scan built on the synchronized moves of the MMC100 (mmc100.mva_sync). Instead of
+            doing a 2D parameter study (e.g. delay x wedge insertion or delay x beam position) as many separate
+            1D runs with manual repositioning, every axis of the controller that was found by probe_axes() can be
+            scanned in one run. The grid is visited in snake (boustrophedon) order, so consecutive points only
+            differ by one step along one axis and the stages never travel back to the start of a line.
+Parameters:
+    stage: an mmc100 class object
+    spec: a spectrometer object
+    inttime: the integration time of the spectrometer
+    scan_axes: list of (axis, start_pos, end_pos, step_size, label) tuples, one for each scanned motor.
+               The last entry is the fastest (innermost) axis, e.g.
+               [(2, 0, -10, 1, 'wedge'), (1, -0.06, 0.06, 0.004, 'delay')]
+    fname: name of the .npz file the results are saved to
+
+The .npz file contains:
+    data: N-D array of spectra, data[i_1, ..., i_N, :] is the spectrum taken at the grid point (i_1, ..., i_N)
+    wavelengths: array of spectrometer wavelengths (the last dimension of data)
+    labels: the label of every scanned axis, in the same order as the dimensions of data
+    axes: the controller number of every scanned axis
+    <label>: the array of positions [mm] of the axis with that label
+"""
+import numpy as np
+from device_session import mark_scan
+
+
+def snake_order(shape):
+  '''Returns the list of grid indices of an N-D grid in snake (boustrophedon) order.
+     The last dimension varies fastest and reverses its direction every time an outer index changes.'''
+  order = [()]
+  for n in shape:
+    new_order = []
+    for k, idx in enumerate(order):
+      line = range(n) if k % 2 == 0 else range(n-1, -1, -1) #every other line is traversed backwards
+      new_order.extend(idx + (i,) for i in line)
+    order = new_order
+  return order
+
+
+def raster_scan(stage, spec, inttime, scan_axes, fname='raster_data.npz'):
+  print('starting raster scan')
+  #*******Initialization*******
+  mark_scan(stage, spec) #start of the scan in a recorded session (see device_session.py)
+  axes = [ax[0] for ax in scan_axes] #controller numbers
+  labels = [ax[4] for ax in scan_axes]
+  for axis in axes:
+    if axis not in stage.axes:
+      raise ValueError('axis ' + str(axis) + ' was not found on the controller (found: ' + str(stage.axes) + ')')
+  grids = []
+  for axis, start_pos, end_pos, step_size, label in scan_axes:
+    n = int(abs(start_pos-end_pos)/step_size + 1) #number of positions along this axis
+    grids.append(np.linspace(start_pos, end_pos, n))
+  shape = tuple(len(g) for g in grids)
+
+  spec.integration_time_micros(inttime) #sets spectrometer's integration time
+  w = spec.wavelengths() #array of spectrometer wavelegnths
+  data = np.zeros(shape + (len(w),)) #one spectrum per grid point
+  home = dict((axis, stage.get_pos(axis)) for axis in axes) #positions to return to after the scan
+
+  #*******Raster scan*******
+  order = snake_order(shape)
+  prev = None
+  for count, idx in enumerate(order):
+    if prev is None: #first point, all the axes move to their start positions together
+      targets = dict((axis, grids[k][idx[k]]) for k, axis in enumerate(axes))
+    else: #only the axes whose index changed have to move
+      targets = dict((axis, grids[k][idx[k]]) for k, axis in enumerate(axes) if idx[k] != prev[k])
+    stage.mva_sync(targets)
+    data[idx] = spec.intensities() #captures spectrum
+    prev = idx
+    print(str(count+1) + '/' + str(len(order))) #to keep track of how many positions are left in the scan
+
+  stage.mva_sync(home) #returns the motors to where they were before the scan
+  print('Raster scan finished\n Data will now be saved\n\n')
+
+  #*******Finalization*******
+  positions = dict((label, g) for label, g in zip(labels, grids))
+  with open(fname, 'wb') as f:
+    np.savez(f, data=data, wavelengths=w, labels=np.array(labels), axes=np.array(axes), **positions)
+  return data
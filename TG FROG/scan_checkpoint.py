@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Helper functions for checkpointing a running scan to disk so that it can be resumed after an
+            interruption (e.g. the serial link to the MMC100 drops or the control panel is closed mid-scan).
+            The checkpoint holds the completed spectrum columns, the full position list, the index of the
+            next unfinished column and the stage/spectrometer settings of the scan.
+
+The checkpoint is a folder. Every save only writes the columns completed since the previous save, as their own
+chunk file, so the cost of a save doesn't grow with the length of the scan:
+    cols_NNNNNN_MMMMMM.npy: the spectrum columns NNNNNN to MMMMMM-1
+    state_MMMMMM.npz: col (= MMMMMM), p, w and the extra scan parameters, written after the chunk it completes
+Files are written under a temporary name and renamed to a name that doesn't exist yet, and the previous state is
+only deleted once the new one is in place, so an interruption at any point leaves the last complete checkpoint readable.
+"""
+import os
+import numpy as np
+
+CHECKPOINT_FILE = 'scan_checkpoint' #default checkpoint folder name (in the working directory)
+
+
+def _files(fname, prefix):
+    '''Returns the sorted list of (numbers in the name, file name) of the files of the checkpoint starting with prefix.'''
+    if not os.path.isdir(fname):
+        return []
+    out = []
+    for name in os.listdir(fname):
+        if name.startswith(prefix) and not name.endswith('.tmp'):
+            out.append((tuple(int(n) for n in os.path.splitext(name)[0].split('_')[1:]), name))
+    return sorted(out)
+
+
+def _write(fname, name, save, *args, **kwargs):
+    '''Writes a file of the checkpoint through a temporary file. Only a chunk can already exist under that name.'''
+    path = os.path.join(fname, name)
+    with open(path + '.tmp', 'wb') as f:
+        save(f, *args, **kwargs)
+    if os.path.exists(path): #a chunk left behind by an interrupted save, never part of a state
+        os.remove(path)
+    os.rename(path + '.tmp', path)
+
+
+def save_checkpoint(fname, col, data, p, w, **state):
+    '''Saves the scan progress to the folder fname. Only the columns completed since the last save are written.\n
+        col: index of the next unfinished column (= number of completed columns)
+        data: the spectrum matrix [len(w) x len(p)], only the first col columns are stored
+        p: array of all scan positions
+        w: array of spectrometer wavelengths
+        state: any extra scan parameters (inttime, step_size, axis, stage position, ...)
+    '''
+    if not os.path.isdir(fname):
+        os.makedirs(fname)
+    states = _files(fname, 'state_')
+    last = states[-1][0][0] if states else 0 #columns already in the checkpoint
+    if states and col == last:
+        return #nothing new since the last save
+    for (c0, c1), name in _files(fname, 'cols_'):
+        if c0 >= last: #written by a save that was interrupted before its state
+            os.remove(os.path.join(fname, name))
+    if col > last:
+        _write(fname, 'cols_%06d_%06d.npy' % (last, col), np.save, np.asarray(data)[:, last:col])
+    _write(fname, 'state_%06d.npz' % col, np.savez, col=col, p=p, w=w, **state)
+    for _, name in states:
+        os.remove(os.path.join(fname, name))
+
+
+def load_checkpoint(fname):
+    '''Loads a checkpoint written by save_checkpoint. Returns a dict of arrays, data holds the completed columns.'''
+    states = _files(fname, 'state_')
+    if not states:
+        raise IOError('no checkpoint in ' + fname)
+    with np.load(os.path.join(fname, states[-1][1])) as f:
+        ck = dict((key, f[key]) for key in f.files)
+    col = int(ck['col'])
+    chunks = [np.load(os.path.join(fname, name)) for (c0, c1), name in _files(fname, 'cols_') if c1 <= col]
+    ck['data'] = np.hstack(chunks) if chunks else np.zeros((len(ck['w']), 0))
+    return ck
+
+
+def clear_checkpoint(fname):
+    '''Deletes the checkpoint once the scan has finished (or before a new scan starts).'''
+    if not os.path.isdir(fname):
+        return
+    for name in os.listdir(fname):
+        if name.startswith('cols_') or name.startswith('state_'):
+            os.remove(os.path.join(fname, name))
+    if not os.listdir(fname):
+        os.rmdir(fname)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Compact storage for very long scans (10^4 - 10^5 positions). Instead of keeping the whole spectrogram in
+            memory as float64 and writing it as %.5f text at the end, the columns are collected in a fixed-size block
+            of a small dtype (uint16 spectrometer counts by default, or float32) and every full block is written to
+            its own file, optionally with lossless zlib compression. Memory use is one block, whatever the length
+            of the scan. ScanReader gives lazy access: slicing it only loads the blocks that are needed, so it can be
+            used as level 0 of a spectrogram_pyramid.SpectrogramPyramid.
+To make use of it:\n
+    writer = scan_storage.ChunkedScanWriter('scan_data', w, p)\n
+    writer.add_column(I, enc, stamp)\n
+    writer.close()\n
+    reader = scan_storage.ScanReader('scan_data')\n
+    part = reader[:, 1000:2000]
+
+The store is a folder with:
+    meta.npz: wavelengths (w), positions (p), dtype, block size, compression and the number of stored columns (ncols)
+    block_NNNNNN.npy (.npz when compressed): [block x len(w)] array, one row per scan column
+    positions.txt: commanded position, measured encoder position and time stamp of every stored column
+"""
+import os
+import numpy as np
+
+
+def _meta_file(fname):
+    return os.path.join(fname, 'meta.npz')
+
+
+def _block_file(fname, b, compress):
+    return os.path.join(fname, 'block_%06d' % b + ('.npz' if compress else '.npy'))
+
+
+class ChunkedScanWriter:
+    def __init__(self, fname, w, p, dtype='uint16', block=256, compress=False, _reopen=False):
+        '''Creates the store folder fname for a scan over the positions p.\n
+            dtype: storage dtype, integer dtypes are rounded and clipped to their range
+            block: number of columns per block file
+            compress: lossless zlib compression of the blocks (np.savez_compressed)
+            _reopen: continue the existing store instead of creating it (used by reopen)'''
+        self.fname = fname
+        self.w = np.asarray(w)
+        self.p = np.asarray(p)
+        self.dtype = np.dtype(dtype)
+        self.block = block
+        self.compress = compress
+        self.ncols = 0 #number of columns written to block files
+        self.buf = np.zeros((block, len(self.w)), dtype=self.dtype)
+        self.nbuf = 0 #number of columns in buf
+        if _reopen:
+            self._restore()
+            return
+        if not os.path.isdir(fname):
+            os.makedirs(fname)
+        self.pos_file = open(os.path.join(fname, 'positions.txt'), 'w')
+        self._write_meta()
+
+    @classmethod
+    def reopen(cls, fname):
+        '''Reopens the store of an interrupted scan. Writing continues after the last column that was written to a
+            block file (next_col() is the next column to acquire).'''
+        with np.load(_meta_file(fname)) as f:
+            meta = dict((key, f[key]) for key in f.files)
+        return cls(fname, meta['w'], meta['p'], dtype=str(meta['dtype']), block=int(meta['block']),
+                   compress=bool(meta['compress']), _reopen=True)
+
+    def _restore(self):
+        '''Loads the stored columns of the last (partial) block into the buffer and truncates positions.txt.'''
+        reader = ScanReader(self.fname)
+        self.nbuf = reader.ncols % self.block #a partial last block goes back into the buffer and is completed
+        self.ncols = reader.ncols - self.nbuf
+        if self.nbuf:
+            self.buf[:self.nbuf] = reader._load_block(self.ncols//self.block)
+        pos_name = os.path.join(self.fname, 'positions.txt')
+        with open(pos_name) as f:
+            lines = f.readlines()[:self.ncols + self.nbuf] #drops the positions of the columns that were never written
+        self.pos_file = open(pos_name, 'w')
+        self.pos_file.writelines(lines)
+
+    def next_col(self):
+        '''Index of the next column to add.'''
+        return self.ncols + self.nbuf
+
+    def add_column(self, I, enc=np.nan, stamp=np.nan):
+        '''Adds the next spectrum (with its encoder position and time stamp). Writes a block file when the block is full.'''
+        col = self.next_col()
+        if self.dtype.kind in 'ui':
+            lim = np.iinfo(self.dtype)
+            I = np.clip(np.rint(I), lim.min, lim.max)
+        self.buf[self.nbuf] = I
+        self.nbuf += 1
+        self.pos_file.write('%.6f,%.6f,%.6f\n' % (self.p[col], enc, stamp))
+        if self.nbuf == self.block:
+            self.flush()
+
+    def flush(self):
+        '''Writes the columns collected so far as the next block file.'''
+        if self.nbuf == 0:
+            return
+        b = self.ncols//self.block
+        with open(_block_file(self.fname, b, self.compress), 'wb') as f:
+            if self.compress:
+                np.savez_compressed(f, data=self.buf[:self.nbuf])
+            else:
+                np.save(f, self.buf[:self.nbuf])
+        self.pos_file.flush()
+        self.ncols += self.nbuf
+        self.nbuf = 0
+        self._write_meta()
+
+    def close(self):
+        self.flush()
+        self.pos_file.close()
+
+    def _write_meta(self):
+        tmp = _meta_file(self.fname) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, w=self.w, p=self.p, dtype=self.dtype.str, block=self.block, compress=self.compress, ncols=self.ncols)
+        if os.path.exists(_meta_file(self.fname)):
+            os.remove(_meta_file(self.fname)) #os.rename can't overwrite on Windows
+        os.rename(tmp, _meta_file(self.fname))
+
+
+class ScanReader:
+    def __init__(self, fname):
+        '''Opens a store written by ChunkedScanWriter. Nothing but the metadata is loaded.'''
+        self.fname = fname
+        with np.load(_meta_file(fname)) as f:
+            self.w, self.p = f['w'], f['p']
+            self.dtype = np.dtype(str(f['dtype']))
+            self.block, self.compress, self.ncols = int(f['block']), bool(f['compress']), int(f['ncols'])
+        self.shape = (len(self.w), self.ncols) #same orientation as the data matrix of the scan functions
+        self.ndim = 2
+
+    def _load_block(self, b):
+        if self.compress:
+            with np.load(_block_file(self.fname, b, True)) as f:
+                return f['data']
+        return np.load(_block_file(self.fname, b, False), mmap_mode='r')
+
+    def columns(self, c0, c1):
+        '''Returns the columns c0 to c1 as a [len(w) x (c1-c0)] array, loading only the blocks that contain them.'''
+        c0, c1 = max(c0, 0), min(c1, self.ncols)
+        out = np.empty((c1 - c0, len(self.w)), dtype=self.dtype)
+        for b in range(c0//self.block, (c1 - 1)//self.block + 1 if c1 > c0 else 0):
+            lo, hi = max(c0, b*self.block), min(c1, (b+1)*self.block)
+            out[lo-c0:hi-c0] = self._load_block(b)[lo - b*self.block:hi - b*self.block]
+        return out.T
+
+    def encoder_positions(self):
+        '''Returns the (commanded, encoder, time stamp) columns of positions.txt.'''
+        return np.loadtxt(os.path.join(self.fname, 'positions.txt'), delimiter=',', ndmin=2)[:self.ncols].T
+
+    def __getitem__(self, key):
+        '''Supports reader[rows, columns] with slices or integers, like the in-memory data matrix.'''
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        rows, cols = key
+        if isinstance(cols, slice):
+            c0, c1, step = cols.indices(self.ncols)
+            return self.columns(c0, c1)[:, ::step][rows] if step > 0 else self.columns(c1+1, c0+1)[:, ::step][rows]
+        cols = int(cols) % self.ncols
+        return self.columns(cols, cols+1)[:, 0][rows]
+
+    def __len__(self):
+        return len(self.w)
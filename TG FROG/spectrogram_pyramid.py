@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Multi-resolution (pyramid) view of a large spectrogram for fast zooming and panning. Level 0 is the full
+            [len(w) x len(p)] intensity matrix, every next level halves both dimensions and keeps the min, max and
+            mean of each 2x2 block. Only the levels with at most max_cells values are kept in memory (as float32);
+            they are either updated column by column while a scan is running (for_scan / add_column) or built lazily,
+            in column chunks, from an existing array, a memory-mapped .npy file or a scan_storage.ScanReader
+            (from_array / from_file). The finer levels are never stored: window() computes the part of them that is
+            viewed from level 0. show() draws the spectrogram as an image placed on the real wavelength and position
+            of every row and column (the wavelength calibration is not linear) and on every zoom/pan picks the coarsest
+            level that still has at least one value per screen pixel (or a coarser one if the view would have more
+            than max_cells values), so memory use and the number of drawn cells stay bounded no matter how big the scan is.
+To make use of it:\n
+    pyramid = spectrogram_pyramid.SpectrogramPyramid.from_array(intensities)\n
+    spectrogram_pyramid.show(ax, pyramid, p, w)
+"""
+import numpy as np
+from matplotlib.image import NonUniformImage
+
+STATS = ('min', 'max', 'mean')
+_NANSTATS = {'min': np.nanmin, 'max': np.nanmax, 'mean': np.nanmean}
+
+
+def _pad_even(a):
+    '''Pads a 2D array with nan to an even number of rows and columns.'''
+    r, c = a.shape
+    if r % 2 == 0 and c % 2 == 0:
+        return a
+    out = np.full((r + r % 2, c + c % 2), np.nan)
+    out[:r, :c] = a
+    return out
+
+
+def _blocks(a):
+    '''Returns a view of a as 2x2 blocks, shape [rows/2 x cols/2 x 4].'''
+    a = _pad_even(np.asarray(a, dtype=float))
+    r, c = a.shape
+    return a.reshape(r//2, 2, c//2, 2).transpose(0, 2, 1, 3).reshape(r//2, c//2, 4)
+
+
+def _reduce(lo_min, lo_max, lo_mean):
+    '''Reduces the min/max/mean arrays of one level to the next (coarser) level.'''
+    with np.errstate(invalid='ignore'):
+        return (np.nanmin(_blocks(lo_min), axis=2), np.nanmax(_blocks(lo_max), axis=2),
+                np.nanmean(_blocks(lo_mean), axis=2))
+
+
+class SpectrogramPyramid:
+    def __init__(self, data, min_size=64, chunk=4096, max_cells=2**22, dtype='float32'):
+        '''data: the full resolution [nrows x ncols] matrix (may be a memmap or a ScanReader), or its (nrows, ncols)
+            shape when the columns are stored elsewhere (set self.data before level 0 or a finer level is viewed).
+            min_size: the coarsest level is the first one with less than min_size rows or columns (and at most
+            max_cells values), chunk: number of level 0 columns reduced at once, max_cells: largest number of values
+            of a level kept in memory and of a drawn view, dtype: dtype of the stored levels.'''
+        self.data = None if isinstance(data, tuple) else data
+        self.chunk = chunk
+        self.max_cells = max_cells
+        self.dtype = np.dtype(dtype)
+        self.shapes = [tuple(data) if isinstance(data, tuple) else data.shape]
+        while True:
+            r, c = self.shapes[-1]
+            if not (min(r, c) >= 2*min_size or (r*c > max_cells and min(r, c) > 1)):
+                break
+            self.shapes.append(((r+1)//2, (c+1)//2))
+        self.levels = [None]*len(self.shapes) #levels[k] = {'min':..., 'max':..., 'mean':...} of the stored levels
+        self.complete = [True] + [False]*(len(self.shapes)-1) #False: the level still has to be built from data
+        self.tail = None #level 0 columns of the block of the finest stored level that is being filled (for_scan)
+
+    @classmethod
+    def from_array(cls, data, **kwargs):
+        '''Pyramid of an existing intensity matrix, the levels are built when they are first viewed.'''
+        return cls(data, **kwargs)
+
+    @classmethod
+    def from_file(cls, fname, **kwargs):
+        '''Pyramid of an intensity matrix saved with np.save. The file is memory-mapped, not loaded.'''
+        return cls(np.load(fname, mmap_mode='r'), **kwargs)
+
+    @classmethod
+    def for_scan(cls, data, **kwargs):
+        '''Pyramid of the intensity matrix of a running scan, filled with add_column as the columns arrive (in order).
+            data is the preallocated matrix, or its (nrows, ncols) shape when the columns are written elsewhere.'''
+        self = cls(data, **kwargs)
+        for k in range(1, len(self.shapes)):
+            if self.stored(k):
+                self.levels[k] = dict((s, np.full(self.shapes[k], np.nan, dtype=self.dtype)) for s in STATS)
+                self.complete[k] = True
+        return self
+
+    @property
+    def nlevels(self):
+        return len(self.shapes)
+
+    def stored(self, k):
+        '''TRUE if level k (k > 0) is small enough to be kept in memory.'''
+        r, c = self.shapes[k]
+        return k > 0 and r*c <= self.max_cells
+
+    def get(self, k, stat='max'):
+        '''Returns the array of level k for the statistic stat ('min', 'max' or 'mean').
+            A level that is not stored is computed from level 0 on every call, use window() for a part of it.'''
+        if k == 0:
+            return self.data
+        if not self.stored(k):
+            return self._from_data(k, stat, 0, self.shapes[k][0], 0, self.shapes[k][1])
+        if not self.complete[k]:
+            self._build(k)
+        return self.levels[k][stat]
+
+    def window(self, k, stat, r0, r1, c0, c1):
+        '''Returns rows r0:r1 and columns c0:c1 of level k. Only the matching part of level 0 is read for a level
+            that is not stored.'''
+        if k == 0 or self.stored(k):
+            return self.get(k, stat)[r0:r1, c0:c1]
+        r1, c1 = min(r1, self.shapes[k][0]), min(c1, self.shapes[k][1])
+        return self._from_data(k, stat, r0, r1, c0, c1)
+
+    def add_column(self, col, I):
+        '''Writes the spectrum I into column col (if the pyramid holds the matrix) and updates the matching block
+            column of every stored level.'''
+        if self.data is not None:
+            self.data[:, col] = I
+        ks = [k for k in range(1, self.nlevels) if self.stored(k)]
+        if not ks:
+            return
+        s = 2**ks[0]
+        if self.tail is None or col % s == 0:
+            self.tail = np.full((self.shapes[0][0], s), np.nan)
+        self.tail[:, col % s] = I
+        for st in STATS:
+            self.levels[ks[0]][st][:, col >> ks[0]] = self._reduce_stat(self.tail, st, ks[0])[:, 0]
+        for k in ks[1:]:
+            c = col >> k #block column of level k
+            c0 = 2*c #first child column in level k-1
+            lo = [self.get(k-1, st)[:, c0:c0+2] for st in STATS]
+            for st, reduced in zip(STATS, _reduce(*lo)):
+                self.levels[k][st][:, c] = reduced[:, 0]
+
+    def _reduce_stat(self, a, stat, k):
+        '''Reduces the level 0 array a k times with the statistic stat.'''
+        a = np.asarray(a, dtype=float)
+        with np.errstate(invalid='ignore'):
+            for _ in range(k):
+                a = _NANSTATS[stat](_blocks(a), axis=2)
+        return a
+
+    def _from_data(self, k, stat, r0, r1, c0, c1):
+        '''Computes rows r0:r1 and columns c0:c1 of level k from level 0, chunk columns at a time.'''
+        s = 2**k
+        out = np.empty((r1-r0, c1-c0), dtype=self.dtype)
+        step = max(self.chunk//s, 1) #level k columns per chunk
+        for a in range(c0, c1, step):
+            b = min(a+step, c1)
+            out[:, a-c0:b-c0] = self._reduce_stat(self.data[r0*s:r1*s, a*s:b*s], stat, k)
+        return out
+
+    def _build(self, k):
+        '''Builds stored level k from level k-1 (or from level 0 if k-1 is not stored), chunk columns at a time so
+            a memory-mapped level 0 is never loaded at once.'''
+        r, c = self.shapes[k]
+        if k > 1 and not self.stored(k-1):
+            self.levels[k] = dict((s, self._from_data(k, s, 0, r, 0, c)) for s in STATS)
+            self.complete[k] = True
+            return
+        level = dict((s, np.empty((r, c), dtype=self.dtype)) for s in STATS)
+        step = self.chunk - self.chunk % 2
+        for c0 in range(0, self.shapes[k-1][1], step):
+            lo = [self.get(k-1, s)[:, c0:c0+step] for s in STATS]
+            for s, reduced in zip(STATS, _reduce(*lo)):
+                level[s][:, c0//2:c0//2+reduced.shape[1]] = reduced
+        self.levels[k] = level
+        self.complete[k] = True
+
+    def level_for(self, ncols, nrows, px_w, px_h):
+        '''Returns the coarsest level with at least one value per screen pixel for a view of ncols x nrows
+            full resolution cells drawn on px_w x px_h pixels, or the first coarser level whose view has at most
+            max_cells values.'''
+        ratio = min(ncols/float(max(px_w, 1)), nrows/float(max(px_h, 1)))
+        k = 0 if ratio < 2 else int(min(np.floor(np.log2(ratio)), self.nlevels-1))
+        while k < self.nlevels-1 and -(-ncols >> k) * -(-nrows >> k) > self.max_cells:
+            k += 1
+        return k
+
+
+def _index_range(axis_values, lo, hi):
+    '''First and last+1 index of the (monotonic) axis values inside [lo, hi].'''
+    idx = np.nonzero((axis_values >= min(lo, hi)) & (axis_values <= max(lo, hi)))[0]
+    if len(idx) == 0:
+        return 0, len(axis_values)
+    return idx[0], idx[-1]+1
+
+
+def _centers(values, k):
+    '''Coordinates of the blocks of level k: the mean of the full resolution coordinates each block covers.'''
+    idx = np.arange(0, len(values), 2**k)
+    return np.add.reduceat(np.asarray(values, dtype=float), idx)/np.diff(np.r_[idx, len(values)])
+
+
+def _set_image(im, x, y, A):
+    '''Sets the data of a NonUniformImage, which needs increasing coordinates.'''
+    if len(x) > 1 and x[0] > x[-1]:
+        x, A = x[::-1], A[:, ::-1]
+    if len(y) > 1 and y[0] > y[-1]:
+        y, A = y[::-1], A[::-1]
+    im.set_data(x, y, A)
+
+
+def show(ax, pyramid, x, y, stat='mean', cmap='hot'):
+    '''Draws the pyramid on ax. x: the column axis (positions), y: the row axis (wavelengths), every row and column is
+        drawn at its own coordinate, so a non-uniform wavelength axis is shown correctly. stat: the statistic of the
+        coarse levels that is shown ('mean', or 'max' to keep narrow peaks visible when zoomed out).
+        The image is re-sliced from the matching level whenever the axis limits change. Returns the image.'''
+    x, y = np.asarray(x), np.asarray(y)
+    k = pyramid.nlevels-1
+    im = NonUniformImage(ax, cmap=cmap, interpolation='nearest')
+    top = pyramid.get(k, stat)
+    _set_image(im, _centers(x, k), _centers(y, k), top)
+    im.set_clim(np.nanmin(top), np.nanmax(top))
+    ax.add_image(im)
+    ax.set_xlim(x[0], x[-1]), ax.set_ylim(y[0], y[-1])
+
+    def update(_ax):
+        c0, c1 = _index_range(x, *ax.get_xlim())
+        r0, r1 = _index_range(y, *ax.get_ylim())
+        k = pyramid.level_for(c1-c0, r1-r0, ax.bbox.width, ax.bbox.height)
+        s = 2**k
+        c0, c1, r0, r1 = c0//s, -(-c1//s), r0//s, -(-r1//s) #block range of level k that covers the view
+        _set_image(im, _centers(x, k)[c0:c1], _centers(y, k)[r0:r1], pyramid.window(k, stat, r0, r1, c0, c1))
+        ax.figure.canvas.draw_idle()
+
+    ax.callbacks.connect('xlim_changed', update)
+    ax.callbacks.connect('ylim_changed', update)
+    update(ax)
+    return im
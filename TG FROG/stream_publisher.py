@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Optional publisher that streams spectra, position readings and scan columns over a local TCP socket, so
+            other processes (analysis, logging, a second viewer) can follow the acquisition without touching the
+            serial port or the spectrometer. publish() only puts the frame in a queue; a background thread sends it
+            to every connected subscriber, so a slow subscriber can never slow down the scan loop (frames are
+            dropped instead when the queue is full). A subscriber that stops reading for longer than send_timeout
+            is disconnected, so it can't stall the other subscribers or close() either.
+To make use of it, create a publisher and pass it to the control panel / scan function:\n
+    publisher = stream_publisher.StreamPublisher(port=5555)\n
+    publisher.publish(stream_publisher.SPECTRUM, spec.intensities())\n
+A subscriber is provided in stream_subscriber.py.
+
+Every frame is binary: a fixed header followed by the shape and the raw array bytes (no text encoding).
+
+    HEADER: magic (4s) | kind (B) | dtype char (c) | ndim (B) | pad | seq (I) | timestamp (d) | value (d)
+    SHAPE:  ndim x uint32
+    DATA:   the array in C order, little endian
+
+value holds a frame specific number, e.g. the commanded position of a scan column.
+"""
+import socket
+import struct
+import threading
+import time
+import numpy as np
+try:
+    import queue
+except ImportError: #python 2
+    import Queue as queue
+
+MAGIC = b'COOP'
+HEADER = struct.Struct('<4sBcBxIdd')
+SHAPE_DIM = struct.Struct('<I')
+
+#frame kinds
+SPECTRUM = 1 #live spectrum of the control panel
+POSITION = 2 #live position reading [theoretical position] of the control panel
+COLUMN = 3 #one spectrum of a scan, seq = column index, value = commanded position
+WAVELENGTHS = 4 #wavelength axis, sent at the start of a scan
+KIND_NAMES = {SPECTRUM: 'spectrum', POSITION: 'position', COLUMN: 'column', WAVELENGTHS: 'wavelengths'}
+
+
+def pack_frame(kind, array, seq=0, value=0.0, timestamp=None):
+    '''Returns the bytes of one frame.'''
+    array = np.ascontiguousarray(array)
+    if array.dtype.byteorder == '>':
+        array = array.astype(array.dtype.newbyteorder('<'))
+    if timestamp is None:
+        timestamp = time.time()
+    header = HEADER.pack(MAGIC, kind, array.dtype.char.encode('ascii'), array.ndim, seq, timestamp, value)
+    shape = b''.join(SHAPE_DIM.pack(n) for n in array.shape)
+    return header + shape + array.tobytes()
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise EOFError('publisher closed the connection')
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def read_frame(sock):
+    '''Reads one frame from a connected socket. Returns (kind, seq, timestamp, value, array).'''
+    magic, kind, dtype, ndim, seq, timestamp, value = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('stream is out of sync (bad frame magic)')
+    shape = tuple(SHAPE_DIM.unpack(_recv_exact(sock, SHAPE_DIM.size))[0] for _ in range(ndim))
+    dtype = np.dtype(dtype.decode('ascii')).newbyteorder('<')
+    count = int(np.prod(shape)) if ndim else 1
+    array = np.frombuffer(_recv_exact(sock, count*dtype.itemsize), dtype=dtype).reshape(shape)
+    return kind, seq, timestamp, value, array
+
+
+class StreamPublisher:
+    def __init__(self, port=5555, host='127.0.0.1', max_queue=256, send_timeout=1.0):
+        '''Starts listening for subscribers on host:port (local only by default).\n
+            send_timeout: a subscriber that takes longer than this [s] to accept a frame is disconnected'''
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+        self.send_timeout = send_timeout
+        self.clients = []
+        self.lock = threading.Lock()
+        self.frames = queue.Queue(max_queue)
+        self.dropped = 0 #number of frames dropped because the queue was full
+        self.running = True
+        for target in (self._accept, self._send):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def publish(self, kind, array, seq=0, value=0.0):
+        '''Queues one frame for all subscribers. Never blocks.'''
+        if not self.running or not self.clients:
+            return #nobody is listening, skip the packing
+        try:
+            self.frames.put_nowait(pack_frame(kind, array, seq, value))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        '''Stops the publisher and disconnects all subscribers.'''
+        self.running = False
+        while True: #drops the frames that were not sent, so the wake-up below can't block on a full queue
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self.frames.put_nowait(None) #wakes up the sender thread
+        except queue.Full: #a frame was published meanwhile, the sender stops after it since running is False
+            pass
+        self.server.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+
+    def _accept(self):
+        while self.running:
+            try:
+                client, addr = self.server.accept()
+            except socket.error:
+                return #server socket was closed
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client.settimeout(self.send_timeout) #sendall raises socket.timeout instead of blocking forever
+            with self.lock:
+                self.clients.append(client)
+
+    def _send(self):
+        while self.running:
+            frame = self.frames.get()
+            if frame is None:
+                return
+            with self.lock:
+                clients = list(self.clients) #sent outside the lock, so _accept and close never wait for a subscriber
+            for client in clients:
+                try:
+                    client.sendall(frame)
+                except socket.error: #subscriber went away or stopped reading (socket.timeout), its stream is out of sync
+                    client.close()
+                    with self.lock:
+                        if client in self.clients:
+                            self.clients.remove(client)
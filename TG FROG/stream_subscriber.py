@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Subscriber (test client) for stream_publisher.py. Connects to the publisher of a running control panel
+            and prints a one line summary of every frame it receives. Other programs can use subscribe() to get the
+            frames as numpy arrays.
+Usage:
+    python stream_subscriber.py [port] [host]
+"""
+import socket
+import sys
+import numpy as np
+from stream_publisher import read_frame, KIND_NAMES
+
+
+def subscribe(port=5555, host='127.0.0.1'):
+    '''Connects to a publisher and yields (kind, seq, timestamp, value, array) for every frame.'''
+    sock = socket.create_connection((host, port))
+    try:
+        while True:
+            yield read_frame(sock)
+    except EOFError:
+        return
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5555
+    host = sys.argv[2] if len(sys.argv) > 2 else '127.0.0.1'
+    for kind, seq, timestamp, value, array in subscribe(port, host):
+        print('%-11s seq=%-6d t=%.3f value=%.6f shape=%s max=%.1f' % (KIND_NAMES.get(kind, kind), seq, timestamp, value,
+                                                                      array.shape, np.max(array)))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Time-zero (temporal overlap) tracker for the delay sweep. The delay marginal (spectrum summed over all
+            wavelengths) is accumulated as the columns arrive. After the sweep the overlap position is estimated the
+            same way as the FWHM approximation of acquisition_func.py (baseline from the first columns, Gaussian
+            filter), as the centroid of the part of the marginal above half maximum. delay_stage moves the stage
+            there instead of to the middle of the scan window, and next_window() gives a narrower window centered on
+            it for the next scan, so drift between scans no longer has to be covered by a wide window.
+To make use of it:\n
+    tracker = time_zero.TimeZeroTracker(p)\n
+    tracker.add_column(col, I)\n
+    t0 = tracker.time_zero()
+"""
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+
+
+class TimeZeroTracker:
+    def __init__(self, p, baseline_cols=10, sigma=3, snr=5):
+        '''p: array of scan positions [mm], baseline_cols: number of first columns used as baseline,
+            sigma: standard deviation of the Gaussian filter [columns], snr: minimum peak height in baseline standard
+            deviations for the overlap to count as found.'''
+        self.p = np.asarray(p, dtype=float)
+        self.marginal = np.full(len(p), np.nan)
+        self.baseline_cols = baseline_cols
+        self.sigma = sigma
+        self.snr = snr
+
+    def add_column(self, col, I):
+        self.marginal[col] = np.sum(I)
+
+    def _smoothed(self):
+        '''Baseline subtracted and filtered marginal of the acquired columns and their positions.'''
+        done = np.isfinite(self.marginal)
+        p, m = self.p[done], self.marginal[done]
+        base = m[:self.baseline_cols]
+        m = gaussian_filter1d(m - np.average(base), self.sigma)
+        return p, m, np.std(base)
+
+    def _half_max_region(self):
+        '''Indices of the contiguous region above half maximum around the peak, or None if there is no clear peak.'''
+        if np.sum(np.isfinite(self.marginal)) <= self.baseline_cols:
+            return None
+        p, m, noise = self._smoothed()
+        peak = np.argmax(m)
+        if m[peak] <= 0 or m[peak] <= self.snr*noise:
+            return None
+        above = m >= m[peak]/2
+        left, right = peak, peak
+        while left > 0 and above[left-1]:
+            left -= 1
+        while right < len(m)-1 and above[right+1]:
+            right += 1
+        return p, m, left, right
+
+    def time_zero(self):
+        '''Returns the estimated overlap position [mm], or None if no peak was found.'''
+        region = self._half_max_region()
+        if region is None:
+            return None
+        p, m, left, right = region
+        return np.sum(p[left:right+1]*m[left:right+1])/np.sum(m[left:right+1]) #centroid above half maximum
+
+    def fwhm(self):
+        '''Returns the FWHM of the delay marginal in stage position [mm], or None if no peak was found.
+            The peak is found on the filtered marginal, but the width is measured on the unfiltered one (baseline
+            subtracted, half maximum crossings interpolated), since the filter would add its own width.'''
+        region = self._half_max_region()
+        if region is None:
+            return None
+        p, m_smooth, left, right = region
+        done = np.isfinite(self.marginal)
+        m = self.marginal[done] - np.average(self.marginal[done][:self.baseline_cols])
+        peak = left + np.argmax(m[left:right+1])
+        half = m[peak]/2
+        lo, hi = peak, peak
+        while lo > 0 and m[lo-1] >= half:
+            lo -= 1
+        while hi < len(m)-1 and m[hi+1] >= half:
+            hi += 1
+        x_lo = p[lo] if lo == 0 else p[lo-1] + (half - m[lo-1])/(m[lo] - m[lo-1])*(p[lo] - p[lo-1])
+        x_hi = p[hi] if hi == len(m)-1 else p[hi] + (m[hi] - half)/(m[hi] - m[hi+1])*(p[hi+1] - p[hi])
+        return abs(x_hi - x_lo)
+
+    def next_window(self, width_factor=2, min_half_width=None):
+        '''Returns (start_pos, end_pos) for the next scan: centered on time zero, width_factor FWHMs to each side
+            (at least min_half_width, default 10 steps), on the step grid of this scan and never wider than it.
+            Returns the window of this scan if no peak was found.'''
+        start, end = self.p[0], self.p[-1]
+        t0, fwhm = self.time_zero(), self.fwhm()
+        if t0 is None:
+            return start, end
+        step = abs(self.p[1] - self.p[0]) if len(self.p) > 1 else 0
+        half = max(width_factor*fwhm, min_half_width if min_half_width is not None else 10*step)
+        if step > 0:
+            t0 = start + np.round((t0 - start)/step)*step #snaps to the step grid
+            half = min(np.ceil(half/step - 1e-9), np.floor(abs(end - start)/2/step + 1e-9))*step #capped after snapping
+        else:
+            half = min(half, abs(end - start)/2)
+        direction = 1 if end >= start else -1
+        return t0 - direction*half, t0 + direction*half